@@ -1,8 +1,27 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
 from flask_wtf import CSRFProtect
+from client.validation import validate_report
+import cache
+import metrics
+import stats
+import storage
+import writer
 import sqlite3
 import os
+import time
 import logging
+import threading
+import atexit
+import base64
+import json
+import gzip
+import ipaddress
+import csv
+import io
+import zlib
+import cProfile
+import functools
+from concurrent.futures import TimeoutError as WriterTimeout
 
 app = Flask(__name__)
 
@@ -10,6 +29,43 @@ app = Flask(__name__)
 
 app.config['DATABASE'] = os.getenv('DATABASE_PATH', 'database.db')  # env var for database path
 
+# applied to every new connection, in this order (auto_vacuum and journal_mode first, they are persistent)
+app.config['SQLITE_PRAGMAS'] = {
+    'auto_vacuum': 'INCREMENTAL',  # new files only: space of dropped partitions can be given back
+    'journal_mode': 'WAL',         # readers no longer block the writer
+    'synchronous': 'NORMAL',       # fsync on checkpoint only, safe with WAL
+    'cache_size': int(os.getenv('SQLITE_CACHE_KB', 65536)) * -1,  # negative = KiB per connection
+    'mmap_size': int(os.getenv('SQLITE_MMAP_BYTES', 268435456)),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'temp_store': 'MEMORY',
+}
+app.config['SQLITE_CACHED_STATEMENTS'] = 256  # sqlite3 default is 128
+app.config['SQLITE_POOL_SIZE'] = int(os.getenv('SQLITE_POOL_SIZE', 16))  # idle connections kept per database
+
+app.config['NDJSON_CHUNK_SIZE'] = int(os.getenv('NDJSON_CHUNK_SIZE', 5000))  # records per commit
+
+app.config['EXPORT_CHUNK_SIZE'] = int(os.getenv('EXPORT_CHUNK_SIZE', 5000))  # rows per read query
+app.config['EXPORT_GZIP_LEVEL'] = int(os.getenv('EXPORT_GZIP_LEVEL', 6))
+
+# time partitions (see storage.py): new partitions span a 'month' or a 'day'; retention drops
+# whole partitions older than PARTITION_RETENTION_DAYS (0 keeps everything)
+app.config['PARTITION_PERIOD'] = os.getenv('PARTITION_PERIOD', 'month')
+app.config['PARTITION_RETENTION_DAYS'] = float(os.getenv('PARTITION_RETENTION_DAYS', 0))
+app.config['PARTITION_DROP_GRACE_S'] = float(os.getenv('PARTITION_DROP_GRACE_S', 60))  # retired, still readable
+app.config['PARTITION_MAINTENANCE_INTERVAL_S'] = float(os.getenv('PARTITION_MAINTENANCE_INTERVAL_S', 60))
+
+# write-behind ingest (see writer.py): 'direct' writes in the request thread, 'queue' hands
+# rows to one writer thread that group-commits them
+app.config['INGEST_MODE'] = os.getenv('INGEST_MODE', 'direct')
+app.config['INGEST_ACK'] = os.getenv('INGEST_ACK', 'commit')  # 'commit' waits for it, 'accepted' returns 202 at once
+app.config['INGEST_GROUP_ROWS'] = int(os.getenv('INGEST_GROUP_ROWS', 5000))  # max rows per group commit
+app.config['INGEST_GROUP_WINDOW_MS'] = float(os.getenv('INGEST_GROUP_WINDOW_MS', 5))  # how long a group stays open
+app.config['INGEST_QUEUE_SIZE'] = int(os.getenv('INGEST_QUEUE_SIZE', 1000))  # waiting requests before submit blocks
+app.config['INGEST_COMMIT_TIMEOUT_S'] = float(os.getenv('INGEST_COMMIT_TIMEOUT_S', 30))  # then 503, rows may still land
+
+# GET pages and API responses are cached per data version (see cache.py); 0 turns the cache off
+app.config['RESPONSE_CACHE_BYTES'] = int(os.getenv('RESPONSE_CACHE_BYTES', 32 * 1024 * 1024))
+
 
 csrf = CSRFProtect(app)
 
@@ -20,154 +76,384 @@ app.config.update(
     SESSION_COOKIE_SECURE=True  
 )
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+
+# duplicates are normal under retries, so only a few per minute make it into the log
+app.config['DUPLICATE_LOG_LIMIT'] = int(os.getenv('DUPLICATE_LOG_LIMIT', 10))
+duplicate_log = metrics.RateLimitedLog(limit=app.config['DUPLICATE_LOG_LIMIT'], interval=60)
+
+# opt-in cProfile per request: send "X-Profile: 1" and find the .prof file in PROFILE_DIR
+app.config['PROFILE_REQUESTS'] = os.getenv('PROFILE_REQUESTS', '0') == '1'
+app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', 'profiles')
 
 
 
+# connections are pooled per database path: a request checks one out on first use and
+# returns it at teardown, so opening one (and parsing the schema, which grows with the
+# partitions) isn't paid again by every request thread
+_pool = {}  # path -> idle connections
+_all_connections = set()
+_pool_lock = threading.Lock()
+_generation = 0  # bumped by close_all_db() so connections checked out before are not returned
+
+
+def connect_db(path):
+    """Open a new tuned connection. Use get_db() unless you need a private one."""
+    conn = sqlite3.connect(
+        path,
+        timeout=app.config['SQLITE_PRAGMAS'].get('busy_timeout', 5000) / 1000,
+        cached_statements=app.config['SQLITE_CACHED_STATEMENTS'],
+        check_same_thread=False,  # pooled: used by one thread at a time, but not always the same one
+        # write transactions take the write lock at BEGIN, where busy_timeout applies, instead of
+        # failing with "database is locked" when a read inside them has to be upgraded
+        isolation_level='IMMEDIATE',
+    )
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        if name == 'auto_vacuum' and conn.execute('PRAGMA page_count').fetchone()[0]:
+            continue  # only matters for a new file, and setting it takes the write lock
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
 def get_db():
-    conn = sqlite3.connect(app.config['DATABASE'])
+    """Return this app context's connection to app.config['DATABASE'], taken from the pool on first use."""
+    start = time.perf_counter()
+    path = app.config['DATABASE']
+    checked_out = g.get('db_connection')
+    if checked_out is not None and checked_out[1] == path and checked_out[2] == _generation:
+        conn = checked_out[0]
+    else:
+        with _pool_lock:
+            idle = _pool.get(path)
+            conn = idle.pop() if idle else None
+            generation = _generation
+        if conn is None:
+            conn = connect_db(path)
+            with _pool_lock:
+                _all_connections.add(conn)
+        if checked_out is not None:
+            _return_db(*checked_out)
+        g.db_connection = (conn, path, generation)
+    metrics.SQL_SECONDS.observe(time.perf_counter() - start, 'get_db')
     return conn
 
+
+def _return_db(conn, path, generation):
+    """Put a connection back into the pool, or close it if the pool is full or was closed meanwhile."""
+    if generation != _generation:
+        return  # closed by close_all_db()
+    try:
+        if conn.in_transaction:
+            conn.rollback()  # never hand out a connection with a transaction left over
+    except sqlite3.ProgrammingError:
+        return  # closed by close_all_db() meanwhile
+    with _pool_lock:
+        idle = _pool.setdefault(path, [])
+        if generation == _generation and len(idle) < app.config['SQLITE_POOL_SIZE']:
+            idle.append(conn)
+            return
+        _all_connections.discard(conn)
+    conn.close()
+
+
+@app.teardown_appcontext
+def release_db(exception):
+    checked_out = g.pop('db_connection', None)
+    if checked_out is not None:
+        _return_db(*checked_out)
+
+
+@atexit.register
+def close_all_db():
+    global _generation
+    with _pool_lock:
+        _generation += 1
+        _pool.clear()
+        connections = list(_all_connections)
+        _all_connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Closing database connection failed: {e}")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """The process-wide group-commit writer, created on first use (after any fork)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            path = app.config['DATABASE']
+            _writer = writer.GroupCommitWriter(
+                lambda: connect_db(path),
+                max_rows=app.config['INGEST_GROUP_ROWS'],
+                window=app.config['INGEST_GROUP_WINDOW_MS'] / 1000,
+                max_queue=app.config['INGEST_QUEUE_SIZE'],
+            )
+        return _writer
+
+
+metrics.Gauge('ingest_queue_depth', 'Submissions waiting for the group-commit writer',
+              lambda: _writer.queue.qsize() if _writer is not None else 0)
+
+
+@atexit.register  # registered after close_all_db, so it runs first
+def close_writer():
+    global _writer
+    with _writer_lock:
+        current, _writer = _writer, None
+    if current is not None:
+        current.close()
+
+response_cache = cache.ResponseCache(app.config['RESPONSE_CACHE_BYTES'])
+
+
+def cached(view):
+    """
+    Serve a GET view from response_cache while the data version is unchanged, with an
+    ETag so polling clients get 304 Not Modified. Only 200 responses are cached.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not app.config['RESPONSE_CACHE_BYTES']:
+            return view(*args, **kwargs)
+        try:
+            with metrics.SQL_SECONDS.time('data_version'):
+                version = (app.config['DATABASE'], storage.data_version(get_db().cursor()))
+        except sqlite3.Error as e:
+            logging.error(f"Reading the data version failed: {e}")
+            return view(*args, **kwargs)
+        key = request.full_path
+        entry = response_cache.get(version, key)
+        if entry is None:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            entry = response_cache.put(version, key, response.get_data(), response.content_type)
+        response = Response(entry.body, content_type=entry.content_type)
+        response.set_etag(entry.etag)
+        response.headers['Cache-Control'] = 'no-cache'  # browsers revalidate every time, which is a 304 at most
+        return response.make_conditional(request)
+
+    return wrapper
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if app.config['PROFILE_REQUESTS'] and request.headers.get('X-Profile') == '1':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def observe_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        path = os.path.join(app.config['PROFILE_DIR'], f"{request.endpoint}-{time.time_ns()}.prof")
+        profiler.dump_stats(path)
+        logging.info(f"Profile of {request.method} {request.path} written to {path}")
+        response.headers['X-Profile-File'] = path
+    start = g.get('request_start')
+    if start is not None:  # None when an earlier before_request handler (CSRF) aborted
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, request.method, route, response.status_code)
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/favicon.ico')
 def favicon():
     return '', 204 
 
 
 def init_db():
-    conn = sqlite3.connect('database.db') 
+    conn = get_db()
     cursor = conn.cursor()
 
 
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS incidents (
-        report_category TEXT,
-        report_type TEXT,
-        timestamp TEXT,
-        source_key TEXT,
-        source_value TEXT,
-        confidence_level TEXT,
-        version INTEGER,
-        report_subcategory TEXT,
-        ip_protocol_number TEXT,
-        ip_version TEXT,
-        UNIQUE (report_category, report_type, timestamp, source_key, source_value, confidence_level)
-    )
-    ''')
-
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS malware_reports (
-        report_category TEXT,
-        report_type TEXT,
-        timestamp TEXT,
-        source_key TEXT,
-        source_value TEXT,
-        confidence_level REAL,
-        version INTEGER,
-        UNIQUE (report_category, report_type, timestamp, source_key, source_value)
-    )
-    ''')
+    # partitioned compact tables (see storage.py); older layouts are converted in the background
+    storage.PARTITION_PERIOD = app.config['PARTITION_PERIOD']
+    migration_pending = storage.create_schema(cursor)
+
+    # summary tables behind /api/stats, filled from existing rows the first time
+    if stats.create_stats_schema(cursor):
+        stats.rebuild_stats(cursor)
 
  
     conn.commit()
-    conn.close()
-               
+
+    if migration_pending:
+        start_migration()
+    start_partition_maintenance()
+
+
+def start_migration():
+    """Convert rows of an older database layout in the background, in small transactions."""
+    def run(path):
+        conn = connect_db(path)
+        try:
+            storage.run_migrations(conn)
+        except sqlite3.Error as e:
+            logging.error(f"Storage migration stopped: {e}")
+        finally:
+            conn.close()
+
+    threading.Thread(target=run, args=(app.config['DATABASE'],), name='storage-migration', daemon=True).start()
+
+
+_maintenance_thread = None
+_maintenance_lock = threading.Lock()
+
+
+def start_partition_maintenance():
+    """
+    Background thread creating the partitions for the current and the next period ahead of
+    ingest (so the views are rarely rebuilt in an upload transaction), applying retention,
+    dropping retired partitions and returning their space.
+    """
+    global _maintenance_thread
+
+    def run(path):
+        conn = connect_db(path)
+        while True:
+            try:
+                with conn:
+                    conn.execute('BEGIN IMMEDIATE')  # the check and the creation in one write transaction
+                    storage.create_upcoming_partitions(conn.cursor(), time.time())
+                if app.config['PARTITION_RETENTION_DAYS']:
+                    cutoff = time.time() - app.config['PARTITION_RETENTION_DAYS'] * 86400
+                    with conn:
+                        storage.expire_partitions(conn.cursor(), cutoff)
+                if storage.drop_retired_partitions(conn, app.config['PARTITION_DROP_GRACE_S']):
+                    storage.reclaim_space(conn)
+            except sqlite3.Error as e:
+                logging.error(f"Partition maintenance failed: {e}")
+            time.sleep(app.config['PARTITION_MAINTENANCE_INTERVAL_S'])
+
+    with _maintenance_lock:
+        if _maintenance_thread is None or not _maintenance_thread.is_alive():
+            _maintenance_thread = threading.Thread(target=run, args=(app.config['DATABASE'],),
+                                                   name='partition-maintenance', daemon=True)
+            _maintenance_thread.start()
 
 
 @app.route('/')
+@cached
 def view_database():
-    try:
-        with get_db() as db:
-            cursor = db.cursor()
+    # rows are fetched page by page from /api/incidents and /api/malware
+    return render_template('index.html')
 
-            cursor.execute('SELECT report_category, report_type, timestamp, source_key, source_value, confidence_level, version, report_subcategory, ip_protocol_number, ip_version FROM incidents')
-            incidents_rows = cursor.fetchall()
-            incidents_data = [
-                {
-                    "report_category": row[0],
-                    "report_type": row[1],
-                    "timestamp": row[2],
-                    "source_key": row[3],
-                    "source_value": row[4],
-                    "confidence_level": row[5],
-                    "version": row[6],
-                    "report_subcategory": row[7],
-                    "ip_protocol_number": row[8],
-                    "ip_version": row[9]
-                } for row in incidents_rows
-            ]
-
-
-            cursor.execute('SELECT report_category, report_type, timestamp, source_key, source_value,confidence_level, version FROM malware_reports')
-            malware_rows = cursor.fetchall()
-            malware_data = [
-                {
-                    "report_category": row[0],
-                    "report_type": row[1],
-                    "timestamp": row[2],
-                    "source_key": row[3],
-                    "source_value": row[4],
-                    "confidence_level": row[5],
-                    "version": row[6]
-                } for row in malware_rows
-            ]
-
-        return render_template('index.html', incidents_data=incidents_data, malware_data=malware_data)
-    except sqlite3.Error as e:
-        logging.error(f"Database query failed: {e}")
-        return jsonify({"message": f"An error occurred while fetching the database contents: {e}"}), 500
+def prepare_records(records):
+    """
+    Validate and encode records for storage.insert_rows().
 
-def insert_into_incidents(data):
-    try:
-        with get_db() as db:
-            cursor = db.cursor()
-            cursor.execute(
-                '''INSERT INTO incidents 
-                (report_category, report_type, timestamp, source_key, source_value, confidence_level, version, report_subcategory, ip_protocol_number, ip_version) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                (
-                    data['report_category'],
-                    data.get('report_type'),
-                    data['timestamp'],
-                    data['source_key'],
-                    data['source_value'],
-                    data['confidence_level'],
-                    data['version'],
-                    data.get('report_subcategory'),
-                    data['ip_protocol_number'],
-                    data['ip_version']
-                )
-            )
-            db.commit()
-        return True  # Insert successful
-    except sqlite3.IntegrityError:
-        logging.error(f"Duplicate entry: {data}")
-        return False  # Duplicate found
+    Returns (results, prepared, labels): results has an "invalid" entry for each
+    rejected record and None for the rest, prepared is a list of (index, table, row).
+    """
+    results = [None] * len(records)
+    prepared = []
+    labels = set()
 
+    for index, data in enumerate(records):
+        is_valid, message = validate_report(data)
+        if not is_valid:
+            results[index] = {"index": index, "status": "invalid", "error": message}
+            continue
+        try:
+            table, row, row_labels = storage.build_row(data)
+        except ValueError as e:
+            results[index] = {"index": index, "status": "invalid", "error": str(e)}
+            continue
+        prepared.append((index, table, row))
+        labels.update(row_labels)
+    if len(prepared) < len(records):
+        metrics.INGEST_RECORDS.inc('invalid', amount=len(records) - len(prepared))
+    return results, prepared, labels
+
+
+def count_outcomes(inserted):
+    added = sum(inserted)
+    if added:
+        metrics.INGEST_RECORDS.inc('inserted', amount=added)
+    if added < len(inserted):
+        metrics.INGEST_RECORDS.inc('duplicate', amount=len(inserted) - added)
 
-def insert_into_malware_reports(data):
-    try:
-        with get_db() as db:
-            cursor = db.cursor()
-            cursor.execute(
-                '''INSERT INTO malware_reports 
-                (report_category, report_type, timestamp, source_key, source_value,  confidence_level, version) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                (
-                    data['report_category'],
-                    data['report_type'],
-                    data['timestamp'],
-                    data['source_key'],
-                    data['source_value'],
-                    data['confidence_level'],
-                    data['version']
-                )
-            )
-            db.commit()
-        return True  # Insert successful
-    except sqlite3.IntegrityError:
-        logging.error(f"Duplicate entry: {data}")
-        return False  # Duplicate found
+
+def record_outcomes(records, results, prepared, inserted):
+    count_outcomes(inserted)
+    for (index, table, _), was_inserted in zip(prepared, inserted):
+        if was_inserted:
+            results[index] = {"index": index, "status": "inserted", "table": table}
+        else:
+            duplicate_log("Duplicate data found: %s", records[index])
+            results[index] = {"index": index, "status": "duplicate", "table": table}
+    return results
+
+
+# direct-mode ingest transactions of this process queue here for their turn; SQLite's
+# busy handler only polls, and under load that lets a writer wait past busy_timeout
+_ingest_lock = threading.Lock()
+
+
+def ingest_records(db, records):
+    """
+    Insert a list of records in a single transaction.
+
+    Every record is checked against its report schema first. Valid ones are
+    written with INSERT OR IGNORE, so the UNIQUE constraints do the duplicate
+    detection instead of a separate COUNT(*) lookup.
+    Returns one {"index", "status"} dict per input record, status being
+    "inserted", "duplicate" or "invalid" (with an "error" message).
+    """
+    results, prepared, labels = prepare_records(records)
+    with _ingest_lock, metrics.SQL_SECONDS.time('ingest_transaction'), db:  # one transaction, rolled back on errors
+        cursor = db.cursor()
+        with metrics.SQL_SECONDS.time('ensure_labels'):
+            storage.ensure_labels(cursor, labels)
+        with metrics.SQL_SECONDS.time('insert_rows'):
+            inserted = storage.insert_rows(cursor, [(table, row) for _, table, row in prepared])
+    return record_outcomes(records, results, prepared, inserted)
+
+
+def enqueue_records(records, wait=True):
+    """
+    Like ingest_records(), but through the group-commit writer.
+
+    With wait=False the call returns as soon as the rows are queued and valid
+    records get status "accepted"; write errors are then only logged. With wait=True
+    it raises WriterTimeout if the commit takes longer than INGEST_COMMIT_TIMEOUT_S.
+    """
+    results, prepared, labels = prepare_records(records)
+    if not prepared:
+        return results
+    future = get_writer().submit([(table, row) for _, table, row in prepared], labels)
+    if not wait:
+        def count(done):
+            if done.exception() is None:
+                count_outcomes(done.result())
+
+        future.add_done_callback(count)
+        for index, table, _ in prepared:
+            results[index] = {"index": index, "status": "accepted", "table": table}
+        return results
+    return record_outcomes(records, results, prepared, future.result(app.config['INGEST_COMMIT_TIMEOUT_S']))
+
+
+def summarize_results(results):
+    summary = {"inserted": 0, "duplicate": 0, "invalid": 0}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    return summary
 
 
 
@@ -185,105 +471,606 @@ def upload_json_files():
     if not isinstance(json_data, list):
         json_data = [json_data]
 
-    # each json upload process
-    has_successful_upload = False
-    has_duplicates = False
+    try:
+        if app.config['INGEST_MODE'] == 'queue':
+            results = enqueue_records(json_data, wait=app.config['INGEST_ACK'] != 'accepted')
+        else:
+            with get_db() as db:
+                results = ingest_records(db, json_data)
+    except WriterTimeout:
+        logging.error("Upload timed out waiting for the ingest writer")
+        return jsonify({"message": "The ingest writer did not commit in time, retry later."}), 503
+    except sqlite3.Error as e:
+        logging.error(f"Database error during upload: {e}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    summary = summarize_results(results)
+    body = {"summary": summary, "results": results}
+
+    if summary.get("accepted"):
+        body["message"] = "JSON data accepted and queued for writing."
+        return jsonify(body), 202
+    elif summary["inserted"]:
+        body["message"] = "All new JSON data uploaded successfully."
+        return jsonify(body), 200
+    elif summary["duplicate"]:
+        body["message"] = "Some or all JSON data is already uploaded (duplicates)."
+        return jsonify(body), 400
+    else:
+        body["message"] = "Errors occurred while uploading JSON data."
+        return jsonify(body), 400
+
 
-    for data in json_data:
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl')
+MAX_REPORTED_ERRORS = 100
+
+
+def iter_ndjson_chunks(stream, chunk_size):
+    """
+    Yield (line_numbers, records, errors) per chunk of up to `chunk_size` lines.
+
+    Only one chunk is held in memory at a time. Lines that aren't valid JSON end up in
+    `errors` as {"line", "status", "error"} instead of in `records`.
+    """
+    line_numbers, records, errors = [], [], []
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
         try:
-            # Check which table 
-            if data['report_category'] == "eu.acdc.attack":
-                if is_duplicate(data):  
-                    logging.info(f"Duplicate data found: {data}")
-                    has_duplicates = True
-                    continue
-                if insert_into_incidents(data):  
-                    has_successful_upload = True
-
-            elif data['report_category'] == "eu.acdc.malware":
-                if is_malware_duplicate(data):  
-                    logging.info(f"Duplicate data found: {data}")
-                    has_duplicates = True
-                    continue
-                if insert_into_malware_reports(data):  
-                    has_successful_upload = True
-
-        except sqlite3.IntegrityError as e:
-            logging.error(f"Database integrity error: {e}")
-            has_duplicates = True
-        except Exception as e:
-            logging.error(f"Unexpected error: {e}")
-            return jsonify({"message": f"Unexpected error: {str(e)}"}), 500
-
-
-    if has_successful_upload:
-        return jsonify({"message": "All new JSON data uploaded successfully."}), 200
-    elif has_duplicates:
-        return jsonify({"message": "Some or all JSON data is already uploaded (duplicates)."}), 400
+            records.append(json.loads(line))
+            line_numbers.append(line_number)
+        except ValueError as e:  # JSONDecodeError and UnicodeDecodeError
+            errors.append({"line": line_number, "status": "invalid", "error": f"Invalid JSON: {e}"})
+        if len(records) + len(errors) >= chunk_size:
+            yield line_numbers, records, errors
+            line_numbers, records, errors = [], [], []
+    if records or errors:
+        yield line_numbers, records, errors
+
+
+@app.route('/upload-ndjson', methods=['POST'])
+@csrf.exempt
+def upload_ndjson():
+    """
+    Streaming bulk ingest: one JSON record per line, optionally gzip-compressed
+    (Content-Encoding: gzip). The body is parsed straight off the request stream and
+    committed every NDJSON_CHUNK_SIZE lines, so memory use doesn't grow with the upload.
+    """
+    if request.mimetype not in NDJSON_CONTENT_TYPES:
+        return jsonify({"message": "Invalid input, application/x-ndjson data required."}), 400
+
+    stream = request.stream
+    if isinstance(stream, io.RawIOBase):
+        # werkzeug's LimitedStream is unbuffered: iterating it reads one byte per call
+        stream = io.BufferedReader(stream, buffer_size=1 << 16)
+    if request.content_encoding == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif request.content_encoding not in (None, '', 'identity'):
+        return jsonify({"message": f"Unsupported Content-Encoding: {request.content_encoding}"}), 415
+
+    tables = {table: {"inserted": 0, "duplicate": 0} for table in storage.FIELDS}
+    summary = {"lines": 0, "chunks": 0, "invalid": 0, "tables": tables, "errors": []}
+
+    def add_errors(errors):
+        summary["invalid"] += len(errors)
+        room = MAX_REPORTED_ERRORS - len(summary["errors"])
+        if room > 0:
+            summary["errors"].extend(errors[:room])
+
+    try:
+        db = get_db()
+        for line_numbers, records, errors in iter_ndjson_chunks(stream, app.config['NDJSON_CHUNK_SIZE']):
+            summary["lines"] += len(records) + len(errors)
+            if errors:
+                metrics.INGEST_RECORDS.inc('invalid', amount=len(errors))
+            if app.config['INGEST_MODE'] == 'queue':
+                results = enqueue_records(records)  # the summary reports committed counts, so always wait
+            else:
+                results = ingest_records(db, records)
+            for line_number, result in zip(line_numbers, results):
+                if result["status"] == "invalid":
+                    errors.append({"line": line_number, "status": "invalid", "error": result["error"]})
+                else:
+                    tables[result["table"]][result["status"]] += 1
+            add_errors(sorted(errors, key=lambda error: error["line"]))
+            summary["chunks"] += 1
+            logging.info(f"NDJSON chunk {summary['chunks']} committed: {tables}, {summary['invalid']} invalid")
+    except WriterTimeout:  # before OSError: from 3.11 on it is the builtin TimeoutError
+        logging.error("NDJSON upload timed out waiting for the ingest writer")
+        summary["message"] = f"The ingest writer did not commit in time after {summary['chunks']} committed chunks."
+        return jsonify(summary), 503
+    except (OSError, EOFError) as e:  # truncated or corrupt gzip stream
+        logging.error(f"NDJSON upload aborted: {e}")
+        summary["message"] = f"Upload aborted after {summary['chunks']} committed chunks: {e}"
+        return jsonify(summary), 400
+    except sqlite3.Error as e:
+        logging.error(f"Database error during NDJSON upload: {e}")
+        summary["message"] = f"Database error after {summary['chunks']} committed chunks: {e}"
+        return jsonify(summary), 500
+
+    if any(counts["inserted"] for counts in tables.values()):
+        summary["message"] = "All new NDJSON data uploaded successfully."
+        return jsonify(summary), 200
+    elif any(counts["duplicate"] for counts in tables.values()):
+        summary["message"] = "Some or all NDJSON data is already uploaded (duplicates)."
+        return jsonify(summary), 400
     else:
-        return jsonify({"message": "Errors occurred while uploading JSON data."}), 400
+        summary["message"] = "Errors occurred while uploading NDJSON data."
+        return jsonify(summary), 400
 
 
 
-def is_duplicate(data):
-    conn = get_db()
-    cursor = conn.cursor()
-    query = """
-    SELECT COUNT(*) FROM incidents 
-    WHERE report_category = ? AND report_type = ? AND timestamp = ? 
-    AND source_key = ? AND source_value = ? AND confidence_level = ?
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, *types):
+    """Opaque cursor -> list of values, checked against `types`. Raises ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if (not isinstance(values, list) or len(values) != len(types)
+            or not all(isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(values, types))):
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+def parse_query_args(table, args, extra=(), default_order='desc'):
     """
-    values = (
-        data['report_category'],
-        data['report_type'],
-        data['timestamp'],
-        data['source_key'],
-        data['source_value'],
-        data['confidence_level']
-    )
-    cursor.execute(query, values)
-    result = cursor.fetchone()[0]
-    conn.close()
-    return result > 0
+    Read filters, cursor token, order and limit from request args. Parameters in
+    `extra` are left to the caller. Raises ValueError on bad input.
+    """
+    filters = {}
+    for name in args:
+        if name in ('cursor', 'limit', 'order') or name in extra:
+            continue
+        if name not in storage.QUERY_FILTERS[table]:
+            raise ValueError(f"Unknown filter: {name}")
+        _, convert = storage.QUERY_FILTERS[table][name]
+        try:
+            filters[name] = convert(args[name])
+        except ValueError:
+            raise ValueError(f"Invalid value for {name}: {args[name]!r}")
 
+    order = args.get('order', default_order).lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be 'asc' or 'desc'.")
 
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer.")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
 
-def is_malware_duplicate(data):
-    conn = get_db()
-    cursor = conn.cursor()
-    query = """
-    SELECT COUNT(*) FROM malware_reports 
-    WHERE report_category = ? AND report_type = ? AND timestamp = ? 
-    AND source_key = ? AND source_value = ?
+    return filters, args.get('cursor') or None, order, limit
+
+
+def build_query(table, filters, cursor=None, order='desc', limit=None, source=None):
     """
-    values = (
-        data['report_category'],
-        data['report_type'],
-        data['timestamp'],
-        data['source_key'],
-        data['source_value']
-    )
-    cursor.execute(query, values)
-    result = cursor.fetchone()[0]
-    conn.close()
-    return result > 0  # true falls duplicate gefunden  
+    SELECT for one page of `table` in (ts, id) order, reading from `source`
+    (a partition, or storage.partition_source()) instead of the whole view if given.
+
+    Pagination is keyset based: the cursor is the (ts, id) of the last row
+    already returned, so page N costs the same as page 1.
+    """
+    conditions = []
+    params = []
+    for name, value in filters.items():
+        conditions.append(storage.QUERY_FILTERS[table][name][0])
+        params.append(value)
+    if cursor is not None:
+        conditions.append('(ts, id) < (?, ?)' if order == 'desc' else '(ts, id) > (?, ?)')
+        params.extend(cursor)
+
+    sql = f"SELECT {storage.select_columns(table)} FROM {source or table}"
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += f" ORDER BY ts {order}, id {order}"
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return sql, params
+
+
+def time_bounds(filters, cursor=None, order='desc'):
+    """The ts range a query can reach, from since/until and the keyset cursor, for partition pruning."""
+    low, high = filters.get('since'), filters.get('until')
+    if cursor is not None:
+        if order == 'desc':
+            high = cursor[0] if high is None else min(high, cursor[0])
+        else:
+            low = cursor[0] if low is None else max(low, cursor[0])
+    return low, high
+
+
+def read_rows(db_cursor, table, filters, cursor, order, limit):
+    """
+    Up to `limit` rows of `table` in (ts, id) order after `cursor`, read one partition
+    at a time (see storage.ordered_partitions()) until the page is full, instead of
+    merging every partition in one compound SELECT.
+    """
+    rows = []
+    for name in storage.ordered_partitions(db_cursor, table, *time_bounds(filters, cursor, order), order):
+        sql, params = build_query(table, filters, cursor, order, limit - len(rows), name)
+        rows.extend(db_cursor.execute(sql, params).fetchall())
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def query_page(table, args):
+    try:
+        filters, token, order, limit = parse_query_args(table, args)
+        cursor = decode_cursor(token, (int, float), int) if token else None
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    try:
+        db_cursor = get_db().cursor()
+        with metrics.SQL_SECONDS.time(f'query_{table}'):
+            rows = read_rows(db_cursor, table, filters, cursor, order, limit + 1)
+        # one extra row tells us whether there is a next page
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        items = storage.decode_rows(db_cursor, app.config['DATABASE'], table, rows)
+    except sqlite3.Error as e:
+        logging.error(f"Database query failed: {e}")
+        return jsonify({"message": f"An error occurred while fetching the database contents: {e}"}), 500
+
+    next_cursor = encode_cursor(rows[-1][storage.TS_COLUMN[table]], rows[-1][0]) if has_more else None
+
+    return jsonify({
+        "items": items,
+        "next_cursor": next_cursor,
+        "limit": limit,
+    }), 200
+
+
+@app.route('/api/incidents')
+@cached
+def api_incidents():
+    return query_page('incidents', request.args)
+
+
+@app.route('/api/malware')
+@cached
+def api_malware():
+    return query_page('malware_reports', request.args)
+
+
+
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def export_chunks(table, filters, cursor, order, fmt, include_cursor):
+    """
+    Yield the export body as text, one block per EXPORT_CHUNK_SIZE rows.
+
+    Each block is a separate keyset query, so no read transaction stays open
+    between blocks: ingest keeps running and WAL checkpoints aren't held back,
+    however long the client takes to read. Memory is bounded by one block.
+    """
+    db_cursor = get_db().cursor()
+    fields = ['id'] + [field for field, _, _ in storage.FIELDS[table]] + (['cursor'] if include_cursor else [])
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        csv_writer = csv.writer(buffer)
+        csv_writer.writerow(fields)
+    while True:
+        with metrics.SQL_SECONDS.time(f'export_{table}'):
+            rows = read_rows(db_cursor, table, filters, cursor, order, app.config['EXPORT_CHUNK_SIZE'])
+        if not rows:
+            break
+        items = storage.decode_rows(db_cursor, app.config['DATABASE'], table, rows)
+        if include_cursor:
+            for item, row in zip(items, rows):
+                item['cursor'] = encode_cursor(row[storage.TS_COLUMN[table]], row[0])
+        if fmt == 'csv':
+            csv_writer.writerows([item[field] for field in fields] for item in items)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            yield ''.join(json.dumps(item, separators=(',', ':')) + '\n' for item in items)
+        if len(rows) < app.config['EXPORT_CHUNK_SIZE']:
+            break
+        cursor = (rows[-1][storage.TS_COLUMN[table]], rows[-1][0])
+    if fmt == 'csv' and buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks, level):
+    """Compress a text stream into one gzip member, flushing after every chunk."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_rows(table, name, args):
+    """
+    Stream every row matching the query API filters as NDJSON (default) or CSV.
+
+    Rows come in ascending (ts, id) order unless order=desc. A cursor token from
+    the query API or from an earlier export resumes after that row; with
+    include_cursor=1 every row carries its own token, so an interrupted transfer
+    can continue from the last row received. Compressed with gzip when the
+    client sends Accept-Encoding: gzip.
+    """
+    try:
+        filters, token, order, _ = parse_query_args(
+            table, args, extra=('format', 'include_cursor'), default_order='asc')
+        cursor = decode_cursor(token, (int, float), int) if token else None
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    fmt = args.get('format', 'ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"message": f"format must be one of: {', '.join(EXPORT_FORMATS)}."}), 400
+    include_cursor = args.get('include_cursor', '0').lower() in ('1', 'true', 'yes')
 
+    def generate():
+        try:
+            yield from export_chunks(table, filters, cursor, order, fmt, include_cursor)
+        except sqlite3.Error as e:
+            # headers are already sent; raising drops the connection so the client sees a truncated transfer
+            logging.error(f"Export of {table} aborted: {e}")
+            raise
+
+    body = stream_with_context(generate())
+    headers = {
+        'Content-Disposition': f'attachment; filename={name}.{fmt}',
+        'Vary': 'Accept-Encoding',
+    }
+    if request.accept_encodings['gzip']:
+        body = gzip_chunks(body, app.config['EXPORT_GZIP_LEVEL'])
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, mimetype=EXPORT_FORMATS[fmt], headers=headers)
+
+
+@app.route('/export/incidents')
+def export_incidents():
+    return export_rows('incidents', 'incidents', request.args)
+
+
+@app.route('/export/malware')
+def export_malware():
+    return export_rows('malware_reports', 'malware', request.args)
+
+
+
+MAX_IP_RANGES = 100
+
+
+def parse_ip_ranges(args):
+    """
+    cidr=<block> and range=<start>-<end> parameters (both repeatable, v4 or v6) ->
+    sorted, merged list of (address length, first, last) with packed addresses.
+    """
+    ranges = []
+    for value in args.getlist('cidr'):
+        try:
+            network = ipaddress.ip_network(value.strip(), strict=False)
+        except ValueError:
+            raise ValueError(f"Invalid CIDR block: {value!r}")
+        ranges.append((network.version, int(network.network_address), int(network.broadcast_address)))
+    for value in args.getlist('range'):
+        start, _, end = value.partition('-')
+        try:
+            first, last = ipaddress.ip_address(start.strip()), ipaddress.ip_address(end.strip())
+        except ValueError:
+            raise ValueError(f"Invalid IP range: {value!r}")
+        if first.version != last.version or first > last:
+            raise ValueError(f"Invalid IP range: {value!r}")
+        ranges.append((first.version, int(first), int(last)))
+    if not ranges:
+        raise ValueError("At least one cidr or range parameter is required.")
+    if len(ranges) > MAX_IP_RANGES:
+        raise ValueError(f"At most {MAX_IP_RANGES} ranges per query.")
+
+    merged = []
+    for version, first, last in sorted(ranges):
+        if merged and merged[-1][0] == version and first <= merged[-1][2] + 1:
+            merged[-1][2] = max(merged[-1][2], last)
+        else:
+            merged.append([version, first, last])
+    return [(4 if version == 4 else 16, first.to_bytes(4 if version == 4 else 16, 'big'),
+             last.to_bytes(4 if version == 4 else 16, 'big')) for version, first, last in merged]
+
+
+def search_ip_ranges(cursor, ranges, filters, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Incidents whose source address falls in one of `ranges`, in (address, id) order.
+
+    Each range is one scan of idx_incidents_ip, visited in order, so the query stops
+    as soon as `limit` rows are found no matter how many rows the ranges cover.
+    `after` is the (length, packed address, id) of the last row already returned.
+    """
+    residual = [storage.QUERY_FILTERS['incidents'][name][0] for name in filters]
+    residual_params = list(filters.values())
+    source = storage.partition_source(cursor, 'incidents', *time_bounds(filters))
+    rows = []
+    for length, first, last in ranges:
+        if after is not None and (length, last) < tuple(after[:2]):
+            continue  # range lies before the cursor
+        conditions = ["typeof(source) = 'blob'", 'length(source) = ?', 'source BETWEEN ? AND ?']
+        params = [length, first, last]
+        if after is not None and length == after[0] and after[1] >= first:
+            params[1] = after[1]  # seek straight to the cursor
+            conditions.append('(source, id) > (?, ?)')
+            params.extend(after[1:])
+        sql = (f"SELECT {storage.select_columns('incidents')} FROM {source} "
+               f"WHERE {' AND '.join(conditions + residual)} ORDER BY source, id LIMIT ?")
+        with metrics.SQL_SECONDS.time('ip_search'):
+            cursor.execute(sql, params + residual_params + [limit - len(rows)])
+            rows.extend(cursor.fetchall())
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+@app.route('/api/incidents/ip-search')
+@cached
+def api_incidents_ip_search():
+    """Incidents by source address: ?cidr=203.0.113.0/24&cidr=2001:db8::/32&range=10.0.0.1-10.0.0.99"""
+    try:
+        ranges = parse_ip_ranges(request.args)
+        filters, token, _, limit = parse_query_args('incidents', request.args, extra=('cidr', 'range'))
+        after = None
+        if token:
+            length, address, row_id = decode_cursor(token, int, str, int)
+            after = (length, bytes.fromhex(address), row_id)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    try:
+        db_cursor = get_db().cursor()
+        rows = search_ip_ranges(db_cursor, ranges, filters, after, limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        items = storage.decode_rows(db_cursor, app.config['DATABASE'], 'incidents', rows)
+    except sqlite3.Error as e:
+        logging.error(f"IP search failed: {e}")
+        return jsonify({"message": f"An error occurred while searching incidents: {e}"}), 500
+
+    next_cursor = None
+    if has_more:
+        source = rows[-1][1 + list(storage.stored_columns('incidents')).index('source')]
+        next_cursor = encode_cursor(len(source), source.hex(), rows[-1][0])
+
+    return jsonify({
+        "items": items,
+        "next_cursor": next_cursor,
+        "limit": limit,
+        "ranges": [{"first": str(ipaddress.ip_address(first)), "last": str(ipaddress.ip_address(last))}
+                   for _, first, last in ranges],
+    }), 200
+
+
+def stats_response(query, *args):
+    try:
+        with metrics.SQL_SECONDS.time(f'stats_{query.__name__}'):
+            items = query(get_db().cursor(), *args)
+        return jsonify({"items": items}), 200
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except sqlite3.Error as e:
+        logging.error(f"Stats query failed: {e}")
+        return jsonify({"message": f"An error occurred while fetching statistics: {e}"}), 500
+
+
+@app.route('/api/stats/incidents-per-hour')
+@cached
+def api_stats_incidents_per_hour():
+    return stats_response(stats.incidents_per_hour, request.args.get('since'), request.args.get('until'),
+                          request.args.get('report_subcategory'))
+
+
+@app.route('/api/stats/top-sources')
+@cached
+def api_stats_top_sources():
+    limit = request.args.get('limit', 10, type=int)
+    return stats_response(stats.top_sources, max(1, min(limit, MAX_PAGE_SIZE)))
+
+
+@app.route('/api/stats/malware-types')
+@cached
+def api_stats_malware_types():
+    return stats_response(stats.malware_types)
+
+
+@app.route('/api/stats/confidence')
+@cached
+def api_stats_confidence():
+    table = {'incidents': 'incidents', 'malware': 'malware_reports'}.get(request.args.get('table', 'incidents'))
+    if table is None:
+        return jsonify({"message": "table must be 'incidents' or 'malware'."}), 400
+    return stats_response(stats.confidence_histogram, table)
+
+
+@app.route('/api/stats/rebuild', methods=['POST'])
+@csrf.exempt
+def api_stats_rebuild():
+    try:
+        with get_db() as db:
+            stats.rebuild_stats(db.cursor())
+        return jsonify({"message": "Statistics have been rebuilt."}), 200
+    except sqlite3.Error as e:
+        logging.error(f"Stats rebuild failed: {e}")
+        return jsonify({"message": "An error occurred while rebuilding statistics."}), 500
+
+
+PARTITION_TABLES = {'incidents': 'incidents', 'malware': 'malware_reports'}
+
+
+def partition_info(table, partition_id, start, end, state='live'):
+    return {"table": table, "name": storage.partition_name(table, partition_id), "state": state,
+            "start": storage.format_timestamp(start), "end": storage.format_timestamp(end)}
+
+
+@app.route('/api/partitions')
+@cached
+def api_partitions():
+    try:
+        cursor = get_db().cursor()
+        cursor.execute('SELECT table_name, id, start_ts, end_ts, state FROM partitions ORDER BY table_name, start_ts')
+        items = [partition_info(*row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"Partition listing failed: {e}")
+        return jsonify({"message": f"An error occurred while listing partitions: {e}"}), 500
+    return jsonify({"items": items, "period": storage.PARTITION_PERIOD}), 200
+
+
+@app.route('/api/partitions/expire', methods=['POST'])
+@csrf.exempt
+def api_partitions_expire():
+    """Retention by hand: ?before=<timestamp>[&table=incidents|malware] drops whole partitions ending by then."""
+    table = request.args.get('table')
+    if table is not None and table not in PARTITION_TABLES:
+        return jsonify({"message": "table must be 'incidents' or 'malware'."}), 400
+    try:
+        before = storage.parse_time_filter(request.args['before'])
+    except KeyError:
+        return jsonify({"message": "before is required."}), 400
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    try:
+        with get_db() as db:
+            expired = storage.expire_partitions(db.cursor(), before, PARTITION_TABLES.get(table))
+    except sqlite3.Error as e:
+        logging.error(f"Partition expiry failed: {e}")
+        return jsonify({"message": "An error occurred while expiring partitions."}), 500
+    start_partition_maintenance()
+    return jsonify({"items": [partition_info(*partition, 'expired') for partition in expired]}), 200
 
 
 @app.route('/reset-database', methods=['POST'])
 @csrf.exempt  # Disable CSRF for this route if you're calling it via AJAX ?
 def reset_database():
     try:
+        if _writer is not None:
+            _writer.flush(app.config['INGEST_COMMIT_TIMEOUT_S'])  # rows queued before the reset must not reappear
         with get_db() as db:
             cursor = db.cursor()
-            cursor.execute('DELETE FROM incidents')  # deletes all rows but keeps the table structure
-            cursor.execute('DELETE FROM malware_reports')  # deletes all rows but keeps the table structure
+            storage.reset_partitions(cursor)  # empty views and stats at once, tables are dropped in the background
             db.commit()
+        start_partition_maintenance()
         return jsonify({"message": "Database has been reset."}), 200
+    except WriterTimeout:
+        logging.error("Database reset timed out waiting for the ingest writer")
+        return jsonify({"message": "The ingest writer did not commit in time, retry later."}), 503
     except sqlite3.Error as e:
         logging.error(f"Database reset failed: {e}")
         return jsonify({"message": "An error occurred while resetting the database."}), 500
 
 if __name__ == '__main__':
-    init_db()
+    with app.app_context():  # get_db() keeps its connection in flask.g
+        init_db()
     app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,365 @@
+"""
+Ingest and read benchmarks for the Flask app, offline, each scenario on a fresh
+temporary database.
+
+    python benchmarks/bench_server.py [--output results.json] [--baseline baseline.json]
+    python benchmarks/bench_server.py --read-sizes 10000,100000,1000000,10000000 --output big.json
+    python benchmarks/bench_server.py --transport http --clients 16
+
+Scenarios:
+  ingest_single       one record per POST /upload-json-files
+  ingest_array        arrays of --batch-size records per POST
+  ingest_ndjson       all records in one POST /upload-ndjson
+  concurrent_direct   --clients threads posting arrays, INGEST_MODE=direct
+  concurrent_queue    the same through the group-commit writer (INGEST_MODE=queue)
+  read_<rows>         page latency (first, deep, filtered, time window, IP search),
+                      /, stats, export throughput and file size at each of --read-sizes,
+                      with the response cache off; *_cached_* repeat a page and / with it on
+
+Records come from synthetic.py (--duplicate-ratio, --payload-bytes, --seed).
+Results are written as JSON; with --baseline every metric is compared to the
+stored run and the script exits with 1 if one regressed by more than --tolerance.
+Metric names say which way is better: *_per_s higher, *_ms / *_bytes lower.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as server  # noqa: E402
+from synthetic import START_TS, generate  # noqa: E402
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds."""
+    ordered = sorted(samples)
+
+    def at(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {"p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99), "mean_ms": statistics.fmean(ordered) * 1000}
+
+
+class Transport:
+    """POST/GET against the app, through the Flask test client or a local HTTP server."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.httpd = None
+        if kind == 'http':
+            import requests
+            from werkzeug.serving import make_server
+            self.requests = requests
+            self.httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+            self.base = f"http://127.0.0.1:{self.httpd.server_port}"
+            threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.local = threading.local()
+
+    def client(self):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = (server.app.test_client() if self.kind == 'test-client'
+                                          else self.requests.Session())
+        return client
+
+    def request(self, method, path, **kwargs):
+        """Returns (status, body bytes)."""
+        client = self.client()
+        if self.kind == 'test-client':
+            response = client.open(path, method=method, **kwargs)
+            return response.status_code, response.get_data()
+        if 'query_string' in kwargs:
+            kwargs['params'] = kwargs.pop('query_string')
+        response = client.request(method, self.base + path, **kwargs)
+        return response.status_code, response.content
+
+    def close(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+
+
+class Database:
+    """
+    A fresh temporary database for one scenario, with the app pointed at it and the
+    response cache off, so repeated reads measure the query. `cache_bytes` is the
+    configured cache size, for the scenarios that measure cached reads on purpose.
+    """
+
+    def __init__(self, ingest_mode='direct'):
+        self.directory = tempfile.mkdtemp(prefix='bench-')
+        self.path = os.path.join(self.directory, 'bench.db')
+        self.ingest_mode = ingest_mode
+
+    def __enter__(self):
+        server.close_writer()
+        server.close_all_db()
+        server.app.config['DATABASE'] = self.path
+        server.app.config['INGEST_MODE'] = self.ingest_mode
+        self.cache_bytes = server.app.config['RESPONSE_CACHE_BYTES']
+        server.app.config['RESPONSE_CACHE_BYTES'] = 0
+        with server.app.app_context():
+            server.init_db()
+        return self
+
+    def size(self):
+        """Database file size after a checkpoint, in bytes."""
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.close()
+        return sum(os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory))
+
+    def __exit__(self, *exc):
+        server.app.config['RESPONSE_CACHE_BYTES'] = self.cache_bytes
+        server.response_cache.clear()
+        server.close_writer()
+        server.close_all_db()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def records(args, count, batch_size, seed=None):
+    return generate(count, duplicate_ratio=args.duplicate_ratio, payload_bytes=args.payload_bytes,
+                    batch_size=batch_size, seed=args.seed if seed is None else seed)
+
+
+def post_batches(transport, batches, latencies):
+    for batch in batches:
+        started = time.perf_counter()
+        status, _ = transport.request('POST', '/upload-json-files', json=batch if len(batch) > 1 else batch[0])
+        latencies.append(time.perf_counter() - started)
+        if status >= 500:
+            raise RuntimeError(f"upload failed with {status}")
+
+
+def bench_ingest_single(args, transport):
+    with Database():
+        latencies = []
+        started = time.perf_counter()
+        post_batches(transport, records(args, args.single_records, 1), latencies)
+        elapsed = time.perf_counter() - started
+    return {"records": args.single_records, "records_per_s": args.single_records / elapsed, **percentiles(latencies)}
+
+
+def bench_ingest_array(args, transport):
+    with Database() as db:
+        latencies = []
+        started = time.perf_counter()
+        post_batches(transport, records(args, args.records, args.batch_size), latencies)
+        elapsed = time.perf_counter() - started
+        size = db.size()
+    return {"records": args.records, "batch_size": args.batch_size, "records_per_s": args.records / elapsed,
+            "db_file_bytes": size, **percentiles(latencies)}
+
+
+def bench_ingest_ndjson(args, transport):
+    with Database():
+        body = ''.join(json.dumps(record) + '\n' for batch in records(args, args.records, 10000) for record in batch)
+        started = time.perf_counter()
+        status, _ = transport.request('POST', '/upload-ndjson', data=body.encode(),
+                                      headers={'Content-Type': 'application/x-ndjson'})
+        elapsed = time.perf_counter() - started
+        if status >= 500:
+            raise RuntimeError(f"NDJSON upload failed with {status}")
+    return {"records": args.records, "records_per_s": args.records / elapsed}
+
+
+def bench_concurrent(args, transport, mode):
+    with Database(ingest_mode=mode):
+        per_client = args.records // args.clients
+        latencies = [[] for _ in range(args.clients)]
+        errors = []
+
+        def client(n):
+            try:
+                post_batches(transport, records(args, per_client, args.batch_size, seed=args.seed + n), latencies[n])
+            except Exception as e:  # reported below, a benchmark with failed uploads is void
+                errors.append(e)
+
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise RuntimeError(f"{len(errors)} clients failed: {errors[0]}")
+    return {"clients": args.clients, "records": per_client * args.clients,
+            "records_per_s": per_client * args.clients / elapsed,
+            **percentiles([latency for samples in latencies for latency in samples])}
+
+
+def load(rows, args):
+    """Insert `rows` records straight through ingest_records(), bypassing HTTP. Returns rows/s."""
+    started = time.perf_counter()
+    with server.app.app_context():
+        db = server.get_db()
+        for batch in generate(rows, payload_bytes=args.payload_bytes, batch_size=10000, seed=args.seed):
+            server.ingest_records(db, batch)
+    return rows / (time.perf_counter() - started)
+
+
+def timed_requests(transport, path, repeat, query_string=None):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        status, body = transport.request('GET', path, query_string=query_string)
+        latencies.append(time.perf_counter() - started)
+        if status != 200:
+            raise RuntimeError(f"GET {path} returned {status}")
+    return percentiles(latencies), body
+
+
+def bench_reads(args, transport, rows):
+    with Database() as db:
+        result = {"rows": rows, "load_rows_per_s": load(rows, args)}
+        result["db_file_bytes"] = db.size()
+        result["db_bytes_per_row"] = result["db_file_bytes"] / rows
+
+        for name, path, query in (
+            ('first_page', '/api/incidents', {'limit': 100}),
+            ('filtered_page', '/api/incidents', {'limit': 100, 'report_subcategory': 'dos', 'min_confidence': 0.5}),
+            # the oldest hour of data: a narrow window far from the newest rows
+            ('time_window', '/api/incidents', {'limit': 100, 'since': START_TS, 'until': START_TS + 3600}),
+            ('ip_search', '/api/incidents/ip-search', {'limit': 100, 'cidr': '10.0.0.0/16'}),
+            ('malware_page', '/api/malware', {'limit': 100}),
+            ('stats_per_hour', '/api/stats/incidents-per-hour', {'since': START_TS, 'until': START_TS + 86400}),
+            ('stats_top_sources', '/api/stats/top-sources', {'limit': 10}),
+            ('index', '/', None),
+        ):
+            summary, _ = timed_requests(transport, path, args.repeat, query)
+            result.update({f"{name}_{key}": value for key, value in summary.items()})
+
+        # the same pages served from the response cache, as polling dashboards see them
+        server.app.config['RESPONSE_CACHE_BYTES'] = db.cache_bytes
+        for name, path, query in (('first_page_cached', '/api/incidents', {'limit': 100}), ('index_cached', '/', None)):
+            timed_requests(transport, path, 1, query)  # fills the cache
+            summary, _ = timed_requests(transport, path, args.repeat, query)
+            result.update({f"{name}_{key}": value for key, value in summary.items()})
+        server.app.config['RESPONSE_CACHE_BYTES'] = 0
+
+        # walk --pages pages with the keyset cursor; the last page costs what the first did
+        latencies, cursor = [], None
+        for _ in range(args.pages):
+            query = {'limit': 100, **({'cursor': cursor} if cursor else {})}
+            summary, body = timed_requests(transport, '/api/incidents', 1, query)
+            latencies.append(summary['p50_ms'] / 1000)
+            cursor = json.loads(body)['next_cursor']
+            if cursor is None:
+                break
+        result.update({f"deep_page_{key}": value for key, value in percentiles(latencies).items()})
+
+        # export a window of about --export-rows records (one record per second of data)
+        window = {'since': START_TS, 'until': START_TS + min(rows, args.export_rows)}
+        started = time.perf_counter()
+        _, body = transport.request('GET', '/export/incidents', query_string=window)
+        result["export_rows_per_s"] = body.count(b'\n') / (time.perf_counter() - started)
+    return result
+
+
+def run_suite(args):
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log per request
+    transport = Transport(args.transport)
+    scenarios = [
+        ('ingest_single', lambda: bench_ingest_single(args, transport)),
+        ('ingest_array', lambda: bench_ingest_array(args, transport)),
+        ('ingest_ndjson', lambda: bench_ingest_ndjson(args, transport)),
+        ('concurrent_direct', lambda: bench_concurrent(args, transport, 'direct')),
+        ('concurrent_queue', lambda: bench_concurrent(args, transport, 'queue')),
+    ] + [(f'read_{rows}', lambda rows=rows: bench_reads(args, transport, rows)) for rows in args.read_sizes]
+
+    results = {}
+    try:
+        for name, scenario in scenarios:
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            started = time.perf_counter()
+            results[name] = scenario()
+            print(f"{name:<20} {time.perf_counter() - started:7.1f}s  "
+                  + '  '.join(f"{key}={value:,.1f}" for key, value in results[name].items()
+                              if key.endswith(('_per_s', 'p50_ms')) and not key.startswith(('stats', 'index'))))
+    finally:
+        transport.close()
+    return results
+
+
+def environment(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(), "cpus": os.cpu_count(), "time": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            "args": {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')}}
+
+
+def compare(results, baseline, tolerance):
+    """Print every metric next to the baseline. Returns the names of regressed metrics."""
+    regressions = []
+    print(f"\n{'metric':<48} {'baseline':>12} {'now':>12} {'change':>8}")
+    for scenario, metrics in results.items():
+        for key, value in metrics.items():
+            old = baseline.get(scenario, {}).get(key)
+            higher_is_better = key.endswith('_per_s')
+            if not isinstance(old, (int, float)) or not old or not key.endswith(('_per_s', '_ms', '_bytes', '_per_row')):
+                continue
+            change = value / old - 1
+            worse = change < -tolerance if higher_is_better else change > tolerance
+            if worse:
+                regressions.append(f"{scenario}.{key}")
+            print(f"{scenario + '.' + key:<48} {old:>12,.2f} {value:>12,.2f} {change:>+8.1%}{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000, help='records per ingest scenario')
+    parser.add_argument('--single-records', type=int, default=1000, help='requests for ingest_single')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1)
+    parser.add_argument('--payload-bytes', type=int, default=0, help='pad records to about this many bytes of JSON')
+    parser.add_argument('--read-sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[10000, 100000], help='comma-separated row counts for the read scenarios')
+    parser.add_argument('--repeat', type=int, default=50, help='requests per read measurement')
+    parser.add_argument('--pages', type=int, default=100, help='pages walked for deep pagination')
+    parser.add_argument('--export-rows', type=int, default=50000)
+    parser.add_argument('--transport', choices=('test-client', 'http'), default='test-client')
+    parser.add_argument('--only', type=lambda value: value.split(','), help='comma-separated scenario name prefixes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON from an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative change before a regression')
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    report = {"environment": environment(args), "results": results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Compare report validation strategies on synthetic records.
+
+    python benchmarks/bench_validation.py [--records 20000] [--invalid-ratio 0.05]
+
+  per-call   jsonschema.validate() per record, as client.py used to do
+  compiled   a prebuilt Draft202012Validator per schema
+  fast-path  client.validation.validate_reports()
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'client'))
+
+from jsonschema import Draft202012Validator, FormatChecker, ValidationError, validate  # noqa: E402
+from validation import SCHEMAS, validate_reports  # noqa: E402
+
+
+def make_records(count, invalid_ratio, seed=1):
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        if rng.random() < 0.8:
+            record = {
+                "report_category": "eu.acdc.attack",
+                "report_type": "incident",
+                "timestamp": f"2024-09-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:00Z",
+                "source_key": "ip",
+                "source_value": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+                "confidence_level": rng.random(),
+                "version": 2,
+                "report_subcategory": rng.choice(["dos", "scan", "malware", "login"]),
+                "ip_protocol_number": 6,
+                "ip_version": 4,
+            }
+        else:
+            record = {
+                "report_category": "eu.acdc.malware",
+                "report_type": "Bot from honeypot capture",
+                "timestamp": f"2024-09-{1 + i % 28:02d}T{i % 24:02d}:00:00Z",
+                "source_key": "malware",
+                "source_value": f"{i:064x}",
+                "confidence_level": 1.0,
+                "version": 2,
+            }
+        if rng.random() < invalid_ratio:
+            record["version"] = 3
+        records.append(record)
+    return records
+
+
+def per_call(records):
+    results = []
+    for data in records:
+        try:
+            validate(instance=data, schema=SCHEMAS[data["report_category"]])
+            results.append(True)
+        except ValidationError:
+            results.append(False)
+    return results
+
+
+_validators = {category: Draft202012Validator(schema, format_checker=FormatChecker())
+               for category, schema in SCHEMAS.items()}
+
+
+def compiled(records):
+    return [_validators[data["report_category"]].is_valid(data) for data in records]
+
+
+def fast_path(records):
+    return [is_valid for is_valid, _ in validate_reports(records)]
+
+
+def run(name, func, records):
+    started = time.perf_counter()
+    results = func(records)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<10} {len(records) / elapsed:>12,.0f} records/s  ({sum(results)} valid, {elapsed:.3f}s)")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--invalid-ratio', type=float, default=0.05)
+    args = parser.parse_args()
+
+    records = make_records(args.records, args.invalid_ratio)
+    expected = run('per-call', per_call, records[:min(len(records), 1000)])  # slow, sample only
+    run('compiled', compiled, records)
+    results = run('fast-path', fast_path, records)
+    assert results[:len(expected)] == expected, "fast path disagrees with jsonschema.validate"
@@ -0,0 +1,91 @@
+"""
+Synthetic report records for the benchmarks, derived from the client's
+attack_schema and malware_schema: enum fields pick from their enum, numbers stay
+within minimum/maximum, required fields are always present. Output is
+deterministic for a given seed.
+
+    from synthetic import generate
+    for batch in generate(100000, duplicate_ratio=0.1, payload_bytes=512, batch_size=5000):
+        ...
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'client'))
+
+from validation import attack_schema, malware_schema  # noqa: E402
+
+
+START_TS = 1704067200  # 2024-01-01T00:00:00Z
+REPORT_TYPES = {
+    "eu.acdc.attack": ["incident", "alert", "observation", "honeypot"],
+    "eu.acdc.malware": ["Bot from honeypot capture", "Dropper", "Sample from spam"],
+}
+
+
+def _timestamp(i, step):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(START_TS + i * step))
+
+
+def make_record(schema, i, rng, step=1, padding=''):
+    """One record valid against `schema`; record i is timestamped i * step seconds after START_TS."""
+    category = schema["properties"]["report_category"]["enum"][0]
+    record = {}
+    for field, spec in schema["properties"].items():
+        if field == "timestamp":
+            value = _timestamp(i, step)
+        elif field == "report_type":
+            value = rng.choice(REPORT_TYPES[category]) + padding
+        elif field == "source_value":
+            if category == "eu.acdc.attack":
+                value = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+            else:
+                value = f"{rng.getrandbits(256):064x}"
+        elif "enum" in spec:
+            value = rng.choice(spec["enum"])
+        elif spec["type"] == "number":
+            value = round(rng.uniform(spec.get("minimum", 0.0), spec.get("maximum", 1.0)), 2)
+        elif spec["type"] == "integer":
+            value = rng.randint(spec.get("minimum", 0), spec.get("maximum", 1000))
+        else:
+            value = f"{field}-{i}"
+        record[field] = value
+    return record
+
+
+def _padding(payload_bytes, rng):
+    """Filler for report_type so an attack record serializes to about `payload_bytes`."""
+    if not payload_bytes:
+        return ''
+    size = len(json.dumps(make_record(attack_schema, 0, rng)))
+    return ' ' + 'x' * max(0, payload_bytes - size - 1)
+
+
+def generate(count, duplicate_ratio=0.0, payload_bytes=0, malware_ratio=0.2, batch_size=1000, step=1, seed=1):
+    """
+    Yield lists of up to `batch_size` records, `count` in total. A `duplicate_ratio`
+    share of them repeats a recent record, so it's rejected by the UNIQUE constraints.
+    """
+    rng = random.Random(seed)
+    padding = _padding(payload_bytes, random.Random(seed))
+    recent = []
+    batch = []
+    for i in range(count):
+        if recent and rng.random() < duplicate_ratio:
+            record = rng.choice(recent)
+        else:
+            schema = malware_schema if rng.random() < malware_ratio else attack_schema
+            record = make_record(schema, i, rng, step, padding)
+            if len(recent) < 1000:
+                recent.append(record)
+            else:
+                recent[rng.randrange(1000)] = record
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,78 @@
+"""
+Read cache for rendered pages and API responses.
+
+Entries belong to one data version (storage.data_version()). The first lookup
+with a newer version empties the cache, so a response is never served after a
+write that could change it, and there is nothing to invalidate by hand. Within
+a version the least recently used entries are evicted once the cached bodies
+exceed max_bytes.
+
+Each entry carries a strong ETag derived from its body, so the same content gets
+the same tag in every worker process and a client's If-None-Match still matches
+after the entry was evicted and rebuilt.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metrics
+
+
+LOOKUPS = metrics.Counter('response_cache_lookups_total', 'Response cache lookups by result', ('result',))
+
+
+class CachedResponse:
+    __slots__ = ('body', 'content_type', 'etag')
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded LRU of CachedResponse, for a single data version at a time."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        metrics.Gauge('response_cache_bytes', 'Bytes of response bodies in the cache', lambda: self.size)
+
+    def get(self, version, key):
+        with self.lock:
+            if version != self.version:
+                self._clear(version)
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        LOOKUPS.inc('hit' if entry is not None else 'miss')
+        return entry
+
+    def put(self, version, key, body, content_type):
+        """Store a response built at `version`; returns the entry, cached or not (too large, outdated)."""
+        entry = CachedResponse(body, content_type)
+        with self.lock:
+            if version != self.version or len(body) > self.max_bytes:
+                return entry  # a newer version arrived while it was built, or it would evict everything
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.body)
+            self.entries[key] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.body)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self._clear(None)
+
+    def _clear(self, version):
+        self.version = version
+        self.entries.clear()
+        self.size = 0
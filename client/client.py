@@ -1,7 +1,15 @@
 import os
 import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from jsonschema import validate, ValidationError, FormatChecker
+from requests.adapters import HTTPAdapter
+from validation import validate_report, validate_reports
+from manifest import UploadManifest, file_digest
 
 
 json_folder = os.path.expanduser('/home/client/client_data_M')  
@@ -23,70 +31,18 @@ config = read_config('config.txt')
 
 server_url = config.get('server_url')
 
-attack_schema = {
-    "$schema": "https://json-schema.org/draft/2020-12/schema",
-    "description": "This document records the details of an incident",
-    "title": "Record of a SIEM Incident",
-    "type": "object",
-    "properties": {
-        "report_category": {"type": "string", "enum": ["eu.acdc.attack"]},
-        "report_type": {"type": "string"},
-        "timestamp": {"type": "string", "format": "date-time"},
-        "source_key": {"type": "string", "enum": ["ip"]},
-        "source_value": {"type": "string"},
-        "confidence_level": {"type": "number", "minimum": 0.0, "maximum": 1.0},
-        "version": {"type": "integer", "enum": [2]},
-        "report_subcategory": {
-            "type": "string",
-            "enum": ["abuse", "abuse.spam", "compromise", "data", "dos", "dos.dns", "dos.http", "dos.tcp", "dos.udp",
-                     "login", "malware", "scan", "other"]
-        },
-        "ip_protocol_number": {"type": "integer", "minimum": 0, "maximum": 255},
-        "ip_version": {"type": "integer", "enum": [4, 6]}
-    },
-    "required": ["report_category", "report_type", "timestamp", "source_key", "source_value", "confidence_level", "version", "report_subcategory",
-                 "ip_protocol_number", "ip_version"]
-}
-
-
-malware_schema = {
-    "$schema": "https://json-schema.org/draft/2020-12/schema",
-    "description": "This document records the details of a malware report",
-    "title": "Malware Report",
-    "type": "object",
-    "properties": {
-        "report_category": {"type": "string", "enum": ["eu.acdc.malware"]},
-        "report_type": {"type": "string"},
-        "timestamp": {"type": "string", "format": "date-time"},
-        "source_key": {"type": "string", "enum": ["malware"]},
-        "source_value": {"type": "string"},
-        "confidence_level": {"type": "number", "minimum": 0.0, "maximum": 1.0},
-        "version": {"type": "integer", "enum": [2]}
-    },
-    "required": [
-        "report_category",
-        "report_type",
-        "timestamp",
-        "source_key",
-        "source_value",
-        "confidence_level",
-        "version"
-    ]
-}
-
-
-
-def validate_report(data):
-    try:
-        if data.get("report_category") == "eu.acdc.attack":
-            validate(instance=data, schema=attack_schema)
-        elif data.get("report_category") == "eu.acdc.malware":
-            validate(instance=data, schema=malware_schema)
-        else:
-            return False, "Invalid report category."
-        return True, "Validation successful."
-    except ValidationError as e:
-        return False, f"Validation error: {e.message}"
+# settings for the batching uploader (--fast)
+batch_size = int(config.get('batch_size', 500))        # records per POST
+read_workers = int(config.get('read_workers', 8))      # threads reading + validating files
+max_in_flight = int(config.get('max_in_flight', 4))    # batches being sent at the same time
+max_retries = int(config.get('max_retries', 5))        # per batch, on 5xx and connection errors
+retry_backoff = float(config.get('retry_backoff', 0.5))  # seconds, doubled per attempt
+request_timeout = float(config.get('request_timeout', 60))
+
+# sync state for --fast/--watch, so later runs only send new or changed files
+manifest_path = config.get('manifest_path', 'upload_manifest.db')
+watch_window = float(config.get('watch_window', 2.0))    # seconds to collect new files per micro-batch
+poll_interval = float(config.get('poll_interval', 5.0))  # watch mode without inotify
 
 
 def send_to_server(data):
@@ -131,5 +87,287 @@ def process_files():
                 print(f"An error occurred while processing {filename}: {e}")
 
 
+class RetryableError(Exception):
+    pass
+
+
+def make_session(pool_size):
+    session = requests.Session()  # keep-alive, one TCP connection per in-flight batch
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# file_error: the file couldn't be read or parsed, so `errors` holds that one message instead of per-record ones
+LoadedFile = namedtuple('LoadedFile', 'path records errors size mtime_ns sha256 unchanged file_error')
+
+
+def load_file(file_path, known_digest=None):
+    """
+    Read, hash, parse and validate one file. If its content hash equals `known_digest`
+    (the file was only touched) nothing is parsed and `unchanged` is set.
+    """
+    filename = os.path.basename(file_path)
+    try:
+        with open(file_path, 'rb') as file:
+            st = os.fstat(file.fileno())
+            content = file.read()
+    except OSError as e:
+        return LoadedFile(file_path, [], [f"An error occurred while processing {filename}: {e}"], None, None, None, False,
+                          True)
+
+    sha256 = file_digest(content)
+    if sha256 == known_digest:
+        return LoadedFile(file_path, [], [], st.st_size, st.st_mtime_ns, sha256, True, False)
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return LoadedFile(file_path, [], [f"Failed to parse JSON in {filename}"], st.st_size, st.st_mtime_ns, sha256,
+                          False, True)
+
+    records = data if isinstance(data, list) else [data]
+    valid, errors = [], []
+    for record, (is_valid, error_message) in zip(records, validate_reports(records)):
+        if is_valid:
+            valid.append(record)
+        else:
+            errors.append(f"Validation failed for {filename}: {error_message}")
+    return LoadedFile(file_path, valid, errors, st.st_size, st.st_mtime_ns, sha256, False, False)
+
+
+def post_batch(session, batch):
+    """POST one array payload, retrying 5xx and connection errors with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            response = session.post(server_url, json=batch, timeout=request_timeout)
+            if response.status_code >= 500:
+                raise RetryableError(f"HTTP {response.status_code}: {response.text[:200]}")
+            # 400 is also returned when everything was a duplicate, the summary tells us
+            try:
+                return response.json().get('summary') or {"rejected": len(batch)}
+            except ValueError:
+                return {"rejected": len(batch)}
+        except (requests.ConnectionError, requests.Timeout, RetryableError) as e:
+            if attempt == max_retries:
+                print(f"Giving up on batch of {len(batch)} records: {e}")
+                return {"failed": len(batch)}
+            delay = retry_backoff * (2 ** attempt) * (1 + random.random() / 2)
+            print(f"Batch upload failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def list_json_files(folder):
+    return [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.json')]
+
+
+def upload_files(paths, session, manifest=None):
+    """
+    High-throughput upload of `paths`: files are read and validated on a thread pool,
+    valid records are sent in array payloads of `batch_size` over `session`, with at
+    most `max_in_flight` batches outstanding.
+
+    With a manifest, a file is marked 'uploaded' once every batch holding one of its
+    records got an answer, 'failed' if one of them was given up on (so it is retried
+    next time), and 'invalid' if it had nothing valid to send.
+    """
+    stats = {"files": len(paths), "unchanged": 0, "file_errors": 0, "records": 0, "invalid": 0, "batches": 0,
+             "inserted": 0, "duplicate": 0, "rejected": 0, "failed": 0}
+    lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    files = {}     # path -> [records not yet answered, failed, LoadedFile], guarded by lock
+    finished = []  # manifest updates, written from this thread only
+    started = time.monotonic()
+
+    def finish(state, status):
+        loaded = state[2]
+        if loaded.sha256 is not None:
+            error = "; ".join(loaded.errors[:5]) or None
+            finished.append((loaded.path, loaded.size, loaded.mtime_ns, loaded.sha256, status, error))
+
+    def send(records, record_paths):
+        try:
+            summary = post_batch(session, records)
+            failed = bool(summary.get("failed"))
+            with lock:
+                stats["batches"] += 1
+                stats["inserted"] += summary.get("inserted", 0)
+                stats["duplicate"] += summary.get("duplicate", 0)
+                stats["rejected"] += summary.get("invalid", 0) + summary.get("rejected", 0)
+                stats["failed"] += summary.get("failed", 0)
+                for path, count in Counter(record_paths).items():
+                    state = files[path]
+                    state[0] -= count
+                    state[1] = state[1] or failed
+                    if state[0] == 0:
+                        finish(state, 'failed' if state[1] else 'uploaded')
+                        del files[path]
+        finally:
+            in_flight.release()
+
+    def submit(records, record_paths):
+        in_flight.acquire()  # blocks while max_in_flight batches are outstanding
+        senders.submit(send, records, record_paths)
+
+    def read(path):
+        return load_file(path, manifest.known_digest(path) if manifest else None)
+
+    batch, batch_paths = [], []
+    with ThreadPoolExecutor(read_workers) as readers, ThreadPoolExecutor(max_in_flight) as senders:
+        # keep a bounded window of reads queued instead of submitting every file at once
+        pending = deque()
+        path_iter = iter(paths)
+        for path in path_iter:
+            pending.append(readers.submit(read, path))
+            if len(pending) >= read_workers * 4:
+                break
+        while pending:
+            loaded = pending.popleft().result()
+            next_path = next(path_iter, None)
+            if next_path is not None:
+                pending.append(readers.submit(read, next_path))
+            for error in loaded.errors:
+                print(error)
+            if loaded.file_error:
+                stats["file_errors"] += 1
+            else:
+                stats["records"] += len(loaded.records) + len(loaded.errors)
+                stats["invalid"] += len(loaded.errors)
+
+            with lock:
+                state = [len(loaded.records), False, loaded]
+                if loaded.unchanged:
+                    stats["unchanged"] += 1
+                    finish(state, manifest.entries[loaded.path][3])
+                elif not loaded.records:
+                    finish(state, 'invalid')
+                else:
+                    files[loaded.path] = state
+                updates = finished[:]
+                del finished[:]
+            if manifest and updates:
+                manifest.mark(updates)
+
+            batch.extend(loaded.records)
+            batch_paths.extend([loaded.path] * len(loaded.records))
+            while len(batch) >= batch_size:
+                submit(batch[:batch_size], batch_paths[:batch_size])
+                batch, batch_paths = batch[batch_size:], batch_paths[batch_size:]
+        if batch:
+            submit(batch, batch_paths)
+
+    if manifest:
+        manifest.mark(finished)
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["records_per_second"] = round(stats["records"] / elapsed, 1) if elapsed else None
+    stats["files_per_second"] = round(stats["files"] / elapsed, 1) if elapsed else None
+    return stats
+
+
+def process_files_fast(folder=None, manifest=None):
+    """One batching run over `folder`; with a manifest only new or changed files are read."""
+    folder = folder or json_folder
+    if not os.path.exists(folder):
+        print("JSON folder not found.")
+        return
+    paths = list_json_files(folder)
+    if manifest:
+        paths = manifest.changed_files(paths)
+    if not paths:
+        print("No JSON files to process.")
+        return
+
+    session = make_session(max_in_flight)
+    try:
+        stats = upload_files(paths, session, manifest)
+    finally:
+        session.close()
+    print(f"Upload summary: {json.dumps(stats)}")
+    return stats
+
+
+def _inotify_events(folder):
+    """Yield lists of new/changed .json paths from inotify, or None if inotify isn't available."""
+    try:
+        from inotify_simple import INotify, flags
+    except ImportError:
+        return None
+
+    inotify = INotify()
+    inotify.add_watch(folder, flags.CLOSE_WRITE | flags.MOVED_TO)
+
+    def events():
+        while True:
+            names = {event.name for event in inotify.read(timeout=int(watch_window * 1000))}
+            yield [os.path.join(folder, name) for name in names if name.endswith('.json')]
+    return events()
+
+
+def _polling_events(folder):
+    while True:
+        time.sleep(poll_interval)
+        yield list_json_files(folder)
+
+
+def watch_folder(folder=None, manifest=None):
+    """
+    Keep running and ship new files as they land: a full sync first, then micro-batches
+    of whatever arrived within `watch_window` seconds. Uses inotify (inotify_simple)
+    when installed and falls back to polling every `poll_interval` seconds.
+    """
+    folder = folder or json_folder
+    if not os.path.exists(folder):
+        print("JSON folder not found.")
+        return
+
+    process_files_fast(folder, manifest)
+    events = _inotify_events(folder)
+    if events is None:
+        print(f"inotify_simple not installed, polling every {poll_interval}s")
+        events = _polling_events(folder)
+
+    session = make_session(max_in_flight)
+    waiting = set()
+    deadline = None
+    try:
+        for paths in events:
+            waiting.update(paths)
+            if waiting and deadline is None:
+                deadline = time.monotonic() + watch_window
+            if not waiting or time.monotonic() < deadline:
+                continue
+            changed = manifest.changed_files(sorted(waiting)) if manifest else sorted(waiting)
+            waiting.clear()
+            deadline = None
+            if changed:
+                stats = upload_files(changed, session, manifest)
+                print(f"Upload summary: {json.dumps(stats)}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        session.close()
+
+
 if __name__ == '__main__':
-    process_files()
+    parser = argparse.ArgumentParser(description="Validate report files and upload them to the server.")
+    parser.add_argument('--fast', action='store_true', help="concurrent, batching upload mode")
+    parser.add_argument('--watch', action='store_true', help="keep running and upload new files as they land")
+    parser.add_argument('--full', action='store_true', help="send every file again (the manifest is still updated)")
+    parser.add_argument('--folder', default=json_folder, help="folder with .json report files")
+    args = parser.parse_args()
+
+    if args.fast or args.watch:
+        manifest = UploadManifest(manifest_path)
+        if args.full:
+            manifest.forget()
+        try:
+            if args.watch:
+                watch_folder(args.folder, manifest)
+            else:
+                process_files_fast(args.folder, manifest)
+        finally:
+            manifest.close()
+    else:
+        json_folder = args.folder
+        process_files()
@@ -0,0 +1,85 @@
+import os
+import time
+import sqlite3
+import hashlib
+
+
+# file is done and only sent again if its content changes
+FINAL_STATUSES = ('uploaded', 'invalid')
+
+
+def file_digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class UploadManifest:
+    """
+    Local record of every file the client has seen: path, size, mtime, content hash
+    and upload status, kept in a small SQLite file next to the client.
+
+    The whole manifest is cached in a dict, so deciding which files need work is a
+    stat() per file and no hashing unless size or mtime changed.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime_ns INTEGER,
+            sha256 TEXT,
+            status TEXT,
+            updated_at REAL,
+            error TEXT
+        )
+        ''')
+        self.conn.commit()
+        self.entries = {
+            path: (size, mtime_ns, sha256, status)
+            for path, size, mtime_ns, sha256, status
+            in self.conn.execute('SELECT path, size, mtime_ns, sha256, status FROM files')
+        }
+
+    def needs_upload(self, path):
+        """False if the file is unchanged (same size and mtime) since it was last finished."""
+        entry = self.entries.get(path)
+        if entry is None or entry[3] not in FINAL_STATUSES:
+            return True
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False  # gone again
+        return (st.st_size, st.st_mtime_ns) != entry[:2]
+
+    def changed_files(self, paths):
+        return [path for path in paths if self.needs_upload(path)]
+
+    def known_digest(self, path):
+        """Hash of the last finished upload of `path`, to skip files that were only touched."""
+        entry = self.entries.get(path)
+        return entry[2] if entry is not None and entry[3] in FINAL_STATUSES else None
+
+    def mark(self, updates):
+        """Store a list of (path, size, mtime_ns, sha256, status, error) in one transaction."""
+        if not updates:
+            return
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, status, updated_at, error) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(path, size, mtime_ns, sha256, status, now, error)
+                 for path, size, mtime_ns, sha256, status, error in updates]
+            )
+        for path, size, mtime_ns, sha256, status, _ in updates:
+            self.entries[path] = (size, mtime_ns, sha256, status)
+
+    def forget(self):
+        """Treat every file as new for this run; entries are rewritten as files finish."""
+        self.entries.clear()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,167 @@
+import re
+from datetime import datetime, timedelta
+from jsonschema import Draft202012Validator, FormatChecker
+from jsonschema.exceptions import best_match
+
+
+attack_schema = {
+    "$schema": "https://json-schema.org/draft/2020-12/schema",
+    "description": "This document records the details of an incident",
+    "title": "Record of a SIEM Incident",
+    "type": "object",
+    "properties": {
+        "report_category": {"type": "string", "enum": ["eu.acdc.attack"]},
+        "report_type": {"type": "string"},
+        "timestamp": {"type": "string", "format": "date-time"},
+        "source_key": {"type": "string", "enum": ["ip"]},
+        "source_value": {"type": "string"},
+        "confidence_level": {"type": "number", "minimum": 0.0, "maximum": 1.0},
+        "version": {"type": "integer", "enum": [2]},
+        "report_subcategory": {
+            "type": "string",
+            "enum": ["abuse", "abuse.spam", "compromise", "data", "dos", "dos.dns", "dos.http", "dos.tcp", "dos.udp",
+                     "login", "malware", "scan", "other"]
+        },
+        "ip_protocol_number": {"type": "integer", "minimum": 0, "maximum": 255},
+        "ip_version": {"type": "integer", "enum": [4, 6]}
+    },
+    "required": ["report_category", "report_type", "timestamp", "source_key", "source_value", "confidence_level", "version", "report_subcategory",
+                 "ip_protocol_number", "ip_version"]
+}
+
+
+malware_schema = {
+    "$schema": "https://json-schema.org/draft/2020-12/schema",
+    "description": "This document records the details of a malware report",
+    "title": "Malware Report",
+    "type": "object",
+    "properties": {
+        "report_category": {"type": "string", "enum": ["eu.acdc.malware"]},
+        "report_type": {"type": "string"},
+        "timestamp": {"type": "string", "format": "date-time"},
+        "source_key": {"type": "string", "enum": ["malware"]},
+        "source_value": {"type": "string"},
+        "confidence_level": {"type": "number", "minimum": 0.0, "maximum": 1.0},
+        "version": {"type": "integer", "enum": [2]}
+    },
+    "required": [
+        "report_category",
+        "report_type",
+        "timestamp",
+        "source_key",
+        "source_value",
+        "confidence_level",
+        "version"
+    ]
+}
+
+
+# report_category -> schema
+SCHEMAS = {
+    "eu.acdc.attack": attack_schema,
+    "eu.acdc.malware": malware_schema,
+}
+
+
+# RFC 3339 date-time; offsets up to 23:59
+_DATE_TIME = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})[Tt](\d{2}):(\d{2}):(\d{2})(\.\d+)?([Zz]|([+-])([01]\d|2[0-3]):([0-5]\d))')
+
+
+def _is_date_time(value):
+    match = _DATE_TIME.fullmatch(value)
+    if match is None:
+        return False
+    year, month, day, hour, minute, second = (int(part) for part in match.groups()[:6])
+    try:
+        moment = datetime(year, month, day, hour, minute, 59 if second == 60 else second)
+    except ValueError:
+        return False
+    if second == 60:  # a leap second, only ever inserted in the last minute of a UTC day
+        sign, offset_hours, offset_minutes = match.groups()[8:]
+        if sign is not None:
+            moment -= int(sign + '1') * timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+        return (moment.hour, moment.minute) == (23, 59)
+    return True
+
+
+# exact types only: bools and integral floats are left to the full validator
+_TYPE_CHECKS = {
+    "string": lambda value: type(value) is str,
+    "integer": lambda value: type(value) is int,
+    "number": lambda value: type(value) in (int, float),
+}
+
+
+def _compile_fast_path(schema):
+    """
+    Turn the properties of `schema` into a flat list of (name, check) pairs.
+
+    The checks are at least as strict as the schema (see _TYPE_CHECKS; date-time is
+    the check the full validator uses too), so a record that passes all of them is
+    valid; a record that fails one isn't necessarily invalid and still goes through
+    the full validator.
+    """
+    required = tuple(schema.get("required", ()))
+    checks = []
+    for name, spec in schema["properties"].items():
+        conditions = [_TYPE_CHECKS[spec["type"]]]
+        if "enum" in spec:
+            allowed = frozenset(spec["enum"])
+            conditions.append(allowed.__contains__)
+        if "minimum" in spec:
+            conditions.append(lambda value, low=spec["minimum"]: value >= low)
+        if "maximum" in spec:
+            conditions.append(lambda value, high=spec["maximum"]: value <= high)
+        if spec.get("format") == "date-time":
+            conditions.append(_is_date_time)
+        checks.append((name, tuple(conditions)))
+    return required, tuple(checks)
+
+
+# jsonschema only checks date-time when the optional rfc3339-validator is installed and
+# otherwise accepts any string, so the full validator gets the fast path's check
+_FORMAT_CHECKER = FormatChecker()
+_FORMAT_CHECKER.checks("date-time")(lambda value: not isinstance(value, str) or _is_date_time(value))
+
+
+def _compile(schema):
+    Draft202012Validator.check_schema(schema)  # once, instead of on every validate() call
+    return Draft202012Validator(schema, format_checker=_FORMAT_CHECKER), _compile_fast_path(schema)
+
+
+_COMPILED = {category: _compile(schema) for category, schema in SCHEMAS.items()}
+
+
+def _fast_path_ok(data, required, checks):
+    for name in required:
+        if name not in data:
+            return False
+    for name, conditions in checks:
+        if name in data:
+            value = data[name]
+            for condition in conditions:
+                if not condition(value):
+                    return False
+    return True
+
+
+def validate_report(data):
+    """Validate one record against the schema for its report_category. Returns (is_valid, message)."""
+    if not isinstance(data, dict):
+        return False, "Record must be a JSON object."
+    compiled = _COMPILED.get(data.get("report_category"))
+    if compiled is None:
+        return False, "Invalid report category."
+    validator, (required, checks) = compiled
+    if _fast_path_ok(data, required, checks):
+        return True, "Validation successful."
+    error = best_match(validator.iter_errors(data))
+    if error is None:
+        return True, "Validation successful."
+    return False, f"Validation error: {error.message}"
+
+
+def validate_reports(records):
+    """Validate a list of records. Returns one (is_valid, message) tuple per record, in order."""
+    return [validate_report(data) for data in records]
@@ -0,0 +1,147 @@
+"""
+In-process instrumentation, exposed in the Prometheus text format by /metrics.
+
+No client library: counters, histograms and callback gauges with a lock each,
+cheap enough for the ingest hot path. Values are per process; with several
+gunicorn workers every worker reports its own series.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+
+REGISTRY = []
+
+# seconds; requests and SQL operations live on different scales
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.values = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        with self.lock:
+            values = sorted((label_values, list(series)) for label_values, series in self.values.items())
+        for label_values, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), label_values + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+class Gauge:
+    """Value read at scrape time from `function`."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, function):
+        self.name, self.help, self.function = name, help, function
+        REGISTRY.append(self)
+
+    def samples(self):
+        yield f"{self.name} {self.function()}"
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+class RateLimitedLog:
+    """
+    At most `limit` log lines per `interval` seconds. Extra calls only bump a counter,
+    reported with the next line that gets through. Arguments are %-formatted lazily,
+    so a suppressed call costs a lock and an increment.
+    """
+
+    def __init__(self, limit=10, interval=60.0, level=logging.INFO):
+        self.limit, self.interval, self.level = limit, interval, level
+        self.window_start = 0.0
+        self.emitted = 0
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, message, *args):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.window_start >= self.interval:
+                self.window_start, self.emitted = now, 0
+            if self.emitted >= self.limit:
+                self.suppressed += 1
+                return
+            self.emitted += 1
+            suppressed, self.suppressed = self.suppressed, 0
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        logging.log(self.level, message, *args)
+
+
+# shared by app.py and writer.py
+REQUEST_SECONDS = Histogram('http_request_duration_seconds',
+                            'Time to build the response, by route (streamed bodies are not included)',
+                            ('method', 'route', 'status'))
+SQL_SECONDS = Histogram('sqlite_operation_duration_seconds',
+                        'Time spent in SQLite, by operation', ('operation',), buckets=SQL_BUCKETS)
+INGEST_RECORDS = Counter('ingest_records_total', 'Uploaded records by outcome', ('status',))
@@ -0,0 +1,171 @@
+"""
+Summary tables for the dashboard, kept current by AFTER INSERT triggers so a stats
+query reads a few hundred rows instead of scanning incidents/malware_reports.
+
+Every partition gets its own trigger, and the summary rows are kept per partition:
+queries sum the rows of the live partitions, so retention and reset leave the
+summary tables alone and stay constant time. The rows of a retired partition go
+with its table in drop_partition_stats(). Triggers only see inserts: after manual
+deletes call rebuild_stats().
+"""
+
+from storage import (LABEL_ID, bump_data_version, decode_source, format_timestamp, live_partitions, parse_time_filter,
+                     partition_name)
+
+# confidence histogram buckets: [0.0, 0.1), [0.1, 0.2) ... [0.9, 1.0]
+CONFIDENCE_BUCKETS = 10
+
+HOUR = "CAST({ts} AS INTEGER) / 3600 * 3600"
+BUCKET = f"MIN(MAX(CAST({{value}} * {CONFIDENCE_BUCKETS} AS INTEGER), 0), {CONFIDENCE_BUCKETS - 1})"
+
+STATS_TABLES = (
+    '''CREATE TABLE IF NOT EXISTS stats_incidents_hourly (
+        partition_id INTEGER,
+        hour INTEGER,
+        subcategory_id INTEGER,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (partition_id, hour, subcategory_id)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS stats_incident_sources (
+        partition_id INTEGER,
+        source BLOB,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (partition_id, source)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS stats_malware_types (
+        partition_id INTEGER,
+        type_id INTEGER,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (partition_id, type_id)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS stats_confidence (
+        partition_id INTEGER,
+        table_name TEXT,
+        bucket INTEGER,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (partition_id, table_name, bucket)
+    ) WITHOUT ROWID''',
+)
+
+# (summary table, key columns, key expressions over the source table, source table)
+AGGREGATES = (
+    ('stats_incidents_hourly', ('hour', 'subcategory_id'),
+     (HOUR.format(ts='{row}ts'), "COALESCE({row}subcategory_id, 0)"), 'incidents'),
+    ('stats_incident_sources', ('source',), ("COALESCE({row}source, '')",), 'incidents'),
+    ('stats_malware_types', ('type_id',), ("COALESCE({row}type_id, 0)",), 'malware_reports'),
+    ('stats_confidence', ('table_name', 'bucket'),
+     ("'incidents'", BUCKET.format(value='{row}confidence')), 'incidents'),
+    ('stats_confidence', ('table_name', 'bucket'),
+     ("'malware_reports'", BUCKET.format(value='{row}confidence')), 'malware_reports'),
+)
+
+SUMMARY_TABLES = ('stats_incidents_hourly', 'stats_incident_sources', 'stats_malware_types', 'stats_confidence')
+
+# summary rows of the partitions a query counts; the partial index on the registry serves it
+LIVE = "partition_id IN (SELECT id FROM partitions WHERE state = 'live' AND table_name = '{table}')"
+
+
+def partition_trigger_sql(source, partition_id):
+    """CREATE TRIGGER counting rows inserted into partition `partition_id` of `source`."""
+    statements = []
+    for table, keys, expressions, source_table in AGGREGATES:
+        if source_table != source:
+            continue
+        values = ', '.join(expression.format(row='NEW.') for expression in expressions)
+        statements.append(
+            f"INSERT INTO {table} (partition_id, {', '.join(keys)}, count) VALUES ({partition_id}, {values}, 1) "
+            f"ON CONFLICT (partition_id, {', '.join(keys)}) DO UPDATE SET count = count + 1;"
+        )
+    return (f"CREATE TRIGGER IF NOT EXISTS trg_stats_{partition_name(source, partition_id)} "
+            f"AFTER INSERT ON {partition_name(source, partition_id)} BEGIN\n" + '\n'.join(statements) + '\nEND')
+
+
+def create_stats_schema(cursor):
+    """
+    Create summary tables and triggers. Returns True if they didn't exist yet (or had
+    the layout without partition_id, which is dropped with its triggers) and need a rebuild.
+    """
+    cursor.execute("PRAGMA table_info(stats_confidence)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if columns and 'partition_id' not in columns:
+        cursor.execute('SELECT table_name, id FROM partitions')
+        for source, partition_id in cursor.fetchall():
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_stats_{partition_name(source, partition_id)}")
+        for table in SUMMARY_TABLES:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    for statement in STATS_TABLES:
+        cursor.execute(statement)
+    for source, partition_id, _, _ in live_partitions(cursor):
+        cursor.execute(partition_trigger_sql(source, partition_id))
+    return 'partition_id' not in columns
+
+
+def rebuild_stats(cursor):
+    """Recompute the summary rows of every live partition from its table. Run inside a transaction."""
+    for table in SUMMARY_TABLES:
+        cursor.execute(f"DELETE FROM {table}")
+    for source, partition_id, _, _ in live_partitions(cursor):
+        for table, keys, expressions, source_table in AGGREGATES:
+            if source_table != source:
+                continue
+            selects = ', '.join(expression.format(row='') for expression in expressions)
+            cursor.execute(
+                f"INSERT INTO {table} (partition_id, {', '.join(keys)}, count) "
+                f"SELECT {partition_id}, {selects}, COUNT(*) FROM {partition_name(source, partition_id)} "
+                f"GROUP BY {', '.join(str(i + 2) for i in range(len(keys)))}"
+            )
+    bump_data_version(cursor)
+
+
+def drop_partition_stats(cursor, partition_id):
+    """
+    Delete the summary rows of a retired partition, as its table is dropped. Queries
+    stopped counting them when it was retired, so this changes no result.
+    """
+    for table in SUMMARY_TABLES:
+        cursor.execute(f"DELETE FROM {table} WHERE partition_id = ?", (partition_id,))
+
+
+def incidents_per_hour(cursor, since=None, until=None, report_subcategory=None):
+    conditions, params = [LIVE.format(table='incidents')], []
+    if since:
+        conditions.append('hour >= ?')
+        params.append(parse_time_filter(since))
+    if until:
+        conditions.append('hour < ?')
+        params.append(parse_time_filter(until))
+    if report_subcategory is not None:
+        conditions.append(f'subcategory_id = {LABEL_ID}')
+        params.append(report_subcategory)
+    cursor.execute('SELECT s.hour, l.value, s.count FROM '
+                   '(SELECT hour, subcategory_id, SUM(count) AS count FROM stats_incidents_hourly '
+                   f"WHERE {' AND '.join(conditions)} GROUP BY hour, subcategory_id) s "
+                   'LEFT JOIN labels l ON l.id = s.subcategory_id ORDER BY s.hour, l.value', params)
+    return [{"hour": format_timestamp(hour), "report_subcategory": subcategory, "count": count}
+            for hour, subcategory, count in cursor.fetchall()]
+
+
+def top_sources(cursor, limit=10):
+    """Sums the per-partition counts of each source, so the cost grows with the distinct sources kept."""
+    cursor.execute('SELECT source, SUM(count) AS total FROM stats_incident_sources '
+                   f"WHERE {LIVE.format(table='incidents')} GROUP BY source ORDER BY total DESC LIMIT ?", (limit,))
+    return [{"source_value": decode_source('incidents', source), "count": count}
+            for source, count in cursor.fetchall()]
+
+
+def malware_types(cursor):
+    cursor.execute('SELECT l.value, s.count FROM '
+                   '(SELECT type_id, SUM(count) AS count FROM stats_malware_types '
+                   f"WHERE {LIVE.format(table='malware_reports')} GROUP BY type_id) s "
+                   'LEFT JOIN labels l ON l.id = s.type_id ORDER BY s.count DESC')
+    return [{"report_type": report_type, "count": count} for report_type, count in cursor.fetchall()]
+
+
+def confidence_histogram(cursor, table_name):
+    cursor.execute('SELECT bucket, SUM(count) FROM stats_confidence WHERE table_name = ? AND partition_id IN '
+                   "(SELECT id FROM partitions WHERE state = 'live' AND table_name = ?) GROUP BY bucket",
+                   (table_name, table_name))
+    counts = dict(cursor.fetchall())
+    width = 1 / CONFIDENCE_BUCKETS
+    return [{"min": round(bucket * width, 2), "max": round((bucket + 1) * width, 2), "count": counts.get(bucket, 0)}
+            for bucket in range(CONFIDENCE_BUCKETS)]
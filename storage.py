@@ -0,0 +1,781 @@
+"""
+Compact on-disk layout for incidents and malware_reports.
+
+Records keep their JSON field names in the API, but are stored as:
+  - timestamps as epoch seconds (INTEGER, or REAL when the source had a fraction);
+    the original spelling goes to ts_text if format_timestamp() wouldn't give it back
+  - report_category/report_type/source_key/report_subcategory as ids into `labels`
+  - source_value packed: IPv4/IPv6 addresses as 4/16 byte blobs in incidents (the
+    original spelling goes to source_text if it wasn't canonical), hex digests as
+    raw bytes in malware_reports; anything else stays TEXT in the same column
+  - confidence_level REAL, version/ip_protocol_number/ip_version INTEGER
+
+Rows live in time partitions: one table per month (or day) and report table,
+listed in the `partitions` registry. `incidents` and `malware_reports` are views
+over the live partitions (UNION ALL, which SQLite merges in index order; nested in
+groups, since a compound SELECT takes at most 500 terms). Keyset reads in ts order
+don't use them: ordered_partitions() lists the partitions to walk one by one, and
+partition_source() narrows other time-bounded reads to the partitions they need.
+Retention and reset only flip registry rows and rebuild the views; the tables
+themselves are dropped later by drop_retired_partitions().
+
+Every transaction that changes what a read can return bumps the counter in
+`data_version`, so response caches in any process can tell when they are stale.
+
+Databases from before partitioning are upgraded by create_schema(), which renames
+their tables to *_legacy (version 0, text columns) or *_unpartitioned (versions 1
+and 2), and migrate_legacy(), which moves the rows over in small transactions
+while the app keeps serving.
+"""
+import re
+import time
+import bisect
+import calendar
+import logging
+import threading
+import ipaddress
+from datetime import datetime
+
+
+SCHEMA_VERSION = 4
+
+# new partitions cover one calendar 'month' or 'day' (UTC)
+PARTITION_PERIOD = 'month'
+
+LABELS_TABLE = '''
+CREATE TABLE IF NOT EXISTS labels (
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL UNIQUE
+)
+'''
+
+PARTITIONS_TABLE = '''
+CREATE TABLE IF NOT EXISTS partitions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'live',  -- live, expired (by retention) or discarded (by reset)
+    retired_at REAL
+)
+'''
+
+# one row; bumped by every write that changes query results (inserts, reset, expiry, drops)
+DATA_VERSION_TABLE = '''
+CREATE TABLE IF NOT EXISTS data_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+)
+'''
+
+PARTITIONS_INDEX = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_partitions_live ON partitions (table_name, start_ts) WHERE state = 'live'"
+)
+
+# partition tables; ids are AUTOINCREMENT from a per-partition base so they stay unique across the view
+INCIDENTS_TABLE = '''
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts INTEGER NOT NULL,
+    ts_text TEXT,
+    category_id INTEGER,
+    type_id INTEGER,
+    source_key_id INTEGER,
+    source BLOB,
+    source_text TEXT,
+    confidence REAL,
+    version INTEGER,
+    subcategory_id INTEGER,
+    ip_protocol_number INTEGER,
+    ip_version INTEGER,
+    UNIQUE (source, ts, type_id, confidence, category_id, source_key_id)
+)
+'''
+# Duplicates are matched on the stored values, not the spelling: the same instant with
+# another UTC offset or fraction digits, or an IP address in another case or notation,
+# is a duplicate, and only the first spelling is kept (in ts_text / source_text).
+
+MALWARE_TABLE = '''
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts INTEGER NOT NULL,
+    ts_text TEXT,
+    category_id INTEGER,
+    type_id INTEGER,
+    source_key_id INTEGER,
+    source BLOB,
+    confidence REAL,
+    version INTEGER,
+    UNIQUE (source, ts, type_id, category_id, source_key_id)
+)
+'''
+
+# indexes for the query API: the filter column leads, ts (plus the implicit rowid)
+# follows, so filter + keyset order + LIMIT is a single index range scan. The UNIQUE
+# constraints already start with (source, ts) and serve the source_value filter.
+PARTITION_TABLES = {'incidents': INCIDENTS_TABLE, 'malware_reports': MALWARE_TABLE}
+
+# per partition (name suffix, definition). Used through the views, SQLite runs
+# these per partition and merges the results.
+QUERY_INDEXES = {
+    'incidents': (
+        ('ts', '(ts)'),
+        ('type', '(type_id, ts)'),
+        ('subcategory', '(subcategory_id, ts)'),
+        # IP range search: only packed addresses, v4 and v6 kept apart by the blob length
+        ('ip', "(length(source), source) WHERE typeof(source) = 'blob'"),
+    ),
+    'malware_reports': (
+        ('ts', '(ts)'),
+        ('type', '(type_id, ts)'),
+    ),
+}
+
+# indexes of the unpartitioned schemas, dropped before their tables are migrated
+LEGACY_INDEXES = ('idx_incidents_timestamp', 'idx_incidents_type', 'idx_incidents_subcategory',
+                  'idx_incidents_source', 'idx_malware_timestamp', 'idx_malware_type', 'idx_malware_source',
+                  'idx_incidents_ts', 'idx_incidents_ip', 'idx_malware_ts')
+
+
+# ---- value codecs ----------------------------------------------------------
+
+_TIMESTAMP = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})(?:[Tt ](\d{2})(?::(\d{2})(?::(\d{2})(\.\d+)?)?)?)?\s*([Zz]|[+-]\d{2}:?\d{2})?')
+
+
+def parse_timestamp(value):
+    """RFC 3339 date-time (or just a date, meaning midnight UTC) -> epoch seconds. Raises ValueError."""
+    match = _TIMESTAMP.fullmatch(value.strip()) if isinstance(value, str) else None
+    if match is None:
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    leap = second == '60'  # POSIX time has no leap seconds: counted as the first second after
+    second = 59 if leap else int(second or 0)
+    moment = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), second)
+    seconds = calendar.timegm(moment.timetuple()) + leap
+    if offset and offset not in 'Zz':
+        sign = -1 if offset[0] == '+' else 1
+        digits = offset[1:].replace(':', '')
+        if int(digits[:2]) > 23 or int(digits[2:]) > 59:
+            raise ValueError(f"Invalid timestamp offset: {value!r}")
+        seconds += sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+    if fraction and int(fraction[1:]):
+        return seconds + float(fraction)
+    return seconds
+
+
+def parse_time_filter(value):
+    """since/until query parameters: epoch seconds or anything parse_timestamp() takes."""
+    return int(value) if value.strip().isdigit() else parse_timestamp(value)
+
+
+def encode_timestamp(value):
+    """timestamp field -> (epoch seconds, original text if format_timestamp() doesn't give it back)."""
+    ts = parse_timestamp(value)
+    return ts, None if format_timestamp(ts) == value else value
+
+
+def format_timestamp(ts):
+    """Epoch seconds -> RFC 3339 in UTC ("2024-09-15T14:30:00Z"), keeping any fraction."""
+    if ts is None:
+        return None
+    whole = int(ts // 1)
+    text = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(whole))
+    if isinstance(ts, float) and ts != whole:
+        text += f"{ts - whole:.6f}"[1:].rstrip('0')
+    return text + 'Z'
+
+
+_HEX_DIGEST = re.compile(r'(?:[0-9a-f]{2}){16,}')
+
+
+def encode_ip(value):
+    """IP source_value -> (packed address, original text if it isn't the canonical spelling)."""
+    if not isinstance(value, str):
+        return value, None
+    try:
+        address = ipaddress.ip_address(value)
+    except ValueError:
+        return value, None
+    return address.packed, None if str(address) == value else value
+
+
+def decode_ip(value, text=None):
+    if text is not None:
+        return text
+    return str(ipaddress.ip_address(value)) if isinstance(value, bytes) else value
+
+
+def encode_source(table, value):
+    """source_value -> stored form of the source column, e.g. for equality filters."""
+    if table == 'incidents':
+        return encode_ip(value)[0]
+    if isinstance(value, str) and _HEX_DIGEST.fullmatch(value):
+        return bytes.fromhex(value)
+    return value
+
+
+def decode_source(table, value):
+    if not isinstance(value, bytes):
+        return value
+    if table == 'incidents':
+        return decode_ip(value)
+    return value.hex()
+
+
+def _int(value):
+    return None if value is None else int(value)
+
+
+def _real(value):
+    return None if value is None else float(value)
+
+
+# ---- table layout -----------------------------------------------------------
+
+# per table: (record field, stored column, kind); kinds are label, ts, ip, source, int, real.
+# ts and ip fields are stored in two columns: the value and ts_text / source_text.
+FIELDS = {
+    'incidents': (
+        ('report_category', 'category_id', 'label'),
+        ('report_type', 'type_id', 'label'),
+        ('timestamp', 'ts', 'ts'),
+        ('source_key', 'source_key_id', 'label'),
+        ('source_value', 'source', 'ip'),
+        ('confidence_level', 'confidence', 'real'),
+        ('version', 'version', 'int'),
+        ('report_subcategory', 'subcategory_id', 'label'),
+        ('ip_protocol_number', 'ip_protocol_number', 'int'),
+        ('ip_version', 'ip_version', 'int'),
+    ),
+    'malware_reports': (
+        ('report_category', 'category_id', 'label'),
+        ('report_type', 'type_id', 'label'),
+        ('timestamp', 'ts', 'ts'),
+        ('source_key', 'source_key_id', 'label'),
+        ('source_value', 'source', 'source'),
+        ('confidence_level', 'confidence', 'real'),
+        ('version', 'version', 'int'),
+    ),
+}
+
+# fields that may be missing from a record (stored as NULL)
+OPTIONAL = {
+    'incidents': {'report_type', 'report_subcategory'},
+    'malware_reports': set(),
+}
+
+# report_category -> table
+REPORT_TABLES = {
+    "eu.acdc.attack": 'incidents',
+    "eu.acdc.malware": 'malware_reports',
+}
+
+LABEL_ID = '(SELECT id FROM labels WHERE value = ?)'
+
+
+def stored_columns(table):
+    for _, column, kind in FIELDS[table]:
+        yield column
+        if kind == 'ts':
+            yield 'ts_text'
+        elif kind == 'ip':
+            yield 'source_text'
+
+
+def insert_sql(table, target):
+    """INSERT OR IGNORE into partition `target` taking the parameters from build_row(); labels are resolved in SQL."""
+    placeholders = {'label': LABEL_ID, 'ts': '?, ?', 'ip': '?, ?'}
+    return (f"INSERT OR IGNORE INTO {target} ({', '.join(stored_columns(table))}) "
+            f"VALUES ({', '.join(placeholders.get(kind, '?') for _, _, kind in FIELDS[table])})")
+
+
+def select_columns(table):
+    return 'id, ' + ', '.join(stored_columns(table))
+
+
+# position of ts in a row selected with select_columns()
+TS_COLUMN = {table: 1 + list(stored_columns(table)).index('ts') for table in FIELDS}
+
+
+def build_row(data):
+    """
+    Map one record to (table, insert parameters, label values). Raises ValueError for
+    records that can't be stored. The labels have to exist before the row is inserted,
+    see ensure_labels().
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Record must be a JSON object.")
+    table = REPORT_TABLES.get(data.get('report_category'))
+    if table is None:
+        raise ValueError(f"Invalid report category: {data.get('report_category')!r}")
+    return encode_fields(table, data)
+
+
+def encode_fields(table, data):
+    optional = OPTIONAL[table]
+    row, labels = [], []
+    for field, _, kind in FIELDS[table]:
+        if field in optional:
+            value = data.get(field)
+        elif field in data:
+            value = data[field]
+        else:
+            raise ValueError(f"Missing field: {field}")
+        try:
+            if kind == 'label':
+                if value is not None:
+                    value = str(value)
+                    labels.append(value)
+            elif kind == 'ts':
+                row.extend(encode_timestamp(value))
+                continue
+            elif kind == 'ip':
+                row.extend(encode_ip(value))
+                continue
+            elif kind == 'source':
+                value = encode_source(table, value)
+            elif kind == 'int':
+                value = _int(value)
+            else:
+                value = _real(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for {field}: {value!r}")
+        row.append(value)
+    return table, tuple(row), labels
+
+
+def ensure_labels(cursor, values):
+    """Insert label values that don't exist yet. Call inside the transaction that uses them."""
+    if values:
+        cursor.executemany('INSERT OR IGNORE INTO labels (value) VALUES (?)', [(value,) for value in set(values)])
+
+
+def insert_rows(cursor, rows):
+    """
+    Insert (table, row) pairs from build_row() with INSERT OR IGNORE into the partition
+    covering each row's timestamp, creating partitions as needed. Call inside the write
+    transaction, after ensure_labels(). One bool per row, False = duplicate.
+    """
+    if not rows:
+        return []
+    spans = {table: [] for table in FIELDS}  # per table, sorted (start_ts, end_ts, id)
+    for table, partition_id, start, end in live_partitions(cursor):
+        spans[table].append((start, end, partition_id))
+    statements = {}
+    created = set()  # tables whose view needs the new partitions
+    inserted = []
+    for table, row in rows:
+        ts = row[TS_COLUMN[table] - 1]
+        table_spans = spans[table]
+        i = bisect.bisect_right(table_spans, (ts, float('inf'))) - 1
+        if i >= 0 and table_spans[i][1] > ts:
+            partition_id = table_spans[i][2]
+        else:
+            partition_id, start, end = create_partition(cursor, table, ts, view=False)
+            created.add(table)
+            bisect.insort(table_spans, (start, end, partition_id))
+        sql = statements.get(partition_id)
+        if sql is None:
+            sql = statements[partition_id] = insert_sql(table, partition_name(table, partition_id))
+        cursor.execute(sql, row)
+        inserted.append(cursor.rowcount == 1)
+    if created:
+        rebuild_views(cursor, created)
+    if any(inserted):
+        bump_data_version(cursor)
+    return inserted
+
+
+def bump_data_version(cursor):
+    """Mark cached reads as stale. Call inside the write transaction."""
+    cursor.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+
+
+def data_version(cursor):
+    """Current data version; it changes with every committed write that read results depend on."""
+    cursor.execute('SELECT version FROM data_version WHERE id = 1')
+    return cursor.fetchone()[0]
+
+
+# id -> value, per database path; labels are never deleted so ids never change meaning
+_label_cache = {}
+_label_cache_lock = threading.Lock()
+
+
+def label_values(cursor, path, ids=()):
+    """id -> label mapping for the database at `path`, reloaded when an unknown id shows up."""
+    cache = _label_cache.get(path)
+    if cache is None or any(i is not None and i not in cache for i in ids):
+        cursor.execute('SELECT id, value FROM labels')
+        cache = dict(cursor.fetchall())
+        with _label_cache_lock:
+            _label_cache[path] = cache
+    return cache
+
+
+def decode_rows(cursor, path, table, rows):
+    """Rows of (id, *stored columns) -> API dicts with the original field names and values."""
+    fields = FIELDS[table]
+    columns = list(stored_columns(table))
+    label_positions = [1 + columns.index(column) for _, column, kind in fields if kind == 'label']
+    labels = label_values(cursor, path, {row[i] for row in rows for i in label_positions})
+    items = []
+    for row in rows:
+        item = {'id': row[0]}
+        position = 1
+        for field, _, kind in fields:
+            value = row[position]
+            position += 1
+            if kind == 'label':
+                value = labels.get(value)
+            elif kind == 'ts':
+                value = row[position] or format_timestamp(value)
+                position += 1
+            elif kind == 'ip':
+                value = decode_ip(value, row[position])
+                position += 1
+            elif kind == 'source':
+                value = decode_source(table, value)
+            item[field] = value
+        items.append(item)
+    return items
+
+
+# query parameter -> (SQL condition, parameter converter), per table
+QUERY_FILTERS = {
+    'incidents': {
+        'since': ('ts >= ?', parse_time_filter),
+        'until': ('ts < ?', parse_time_filter),
+        'report_category': (f'category_id = {LABEL_ID}', str),
+        'report_type': (f'type_id = {LABEL_ID}', str),
+        'report_subcategory': (f'subcategory_id = {LABEL_ID}', str),
+        'source_value': ('source = ?', lambda value: encode_source('incidents', value)),
+        'min_confidence': ('confidence >= ?', float),
+    },
+    'malware_reports': {
+        'since': ('ts >= ?', parse_time_filter),
+        'until': ('ts < ?', parse_time_filter),
+        'report_category': (f'category_id = {LABEL_ID}', str),
+        'report_type': (f'type_id = {LABEL_ID}', str),
+        'source_value': ('source = ?', lambda value: encode_source('malware_reports', value)),
+        'min_confidence': ('confidence >= ?', float),
+    },
+}
+
+
+# ---- partitions ---------------------------------------------------------------
+
+def partition_name(table, partition_id):
+    return f"{table}_p{partition_id}"
+
+
+def period_bounds(ts, period):
+    """[start, end) in epoch seconds of the calendar month or day (UTC) holding `ts`."""
+    moment = time.gmtime(int(ts // 1))
+    if period == 'day':
+        start = calendar.timegm((moment.tm_year, moment.tm_mon, moment.tm_mday, 0, 0, 0))
+        return start, start + 86400
+    year, month = moment.tm_year, moment.tm_mon
+    return (calendar.timegm((year, month, 1, 0, 0, 0)),
+            calendar.timegm((year + month // 12, month % 12 + 1, 1, 0, 0, 0)))
+
+
+def live_partitions(cursor, table=None, low=None, high=None):
+    """
+    (table, id, start_ts, end_ts) of the live partitions, oldest first. With low/high,
+    only partitions that can hold a ts in [low, high].
+    """
+    conditions, params = ["state = 'live'"], []
+    if table is not None:
+        conditions.append('table_name = ?')
+        params.append(table)
+    if low is not None:
+        conditions.append('end_ts > ?')
+        params.append(low)
+    if high is not None:
+        conditions.append('start_ts <= ?')
+        params.append(high)
+    cursor.execute(f"SELECT table_name, id, start_ts, end_ts FROM partitions WHERE {' AND '.join(conditions)} "
+                   f"ORDER BY start_ts", params)
+    return cursor.fetchall()
+
+
+def create_partition(cursor, table, ts, view=True):
+    """
+    Register and create the partition of `table` that holds `ts`, with its indexes and
+    stats trigger, and add it to the view (with view=False the caller rebuilds the view
+    once after creating several). Call inside a write transaction; it bumps the data version.
+    Returns (id, start_ts, end_ts).
+    """
+    import stats  # stats imports storage
+
+    start, end = period_bounds(ts, PARTITION_PERIOD)
+    # partitions made under another PARTITION_PERIOD may already cover part of the period
+    cursor.execute("SELECT max(end_ts) FROM partitions WHERE table_name = ? AND state = 'live' AND end_ts <= ?",
+                   (table, ts))
+    start = max(start, cursor.fetchone()[0] or start)
+    cursor.execute("SELECT min(start_ts) FROM partitions WHERE table_name = ? AND state = 'live' AND start_ts > ?",
+                   (table, ts))
+    end = min(end, cursor.fetchone()[0] or end)
+
+    cursor.execute('INSERT INTO partitions (table_name, start_ts, end_ts) VALUES (?, ?, ?)', (table, start, end))
+    partition_id = cursor.lastrowid
+    name = partition_name(table, partition_id)
+    cursor.execute(PARTITION_TABLES[table].format(name=name))
+    for suffix, definition in QUERY_INDEXES[table]:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_{suffix} ON {name} {definition}")
+    # ids of partition n start above n << 32, so the views never show the same id twice
+    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (name, partition_id << 32))
+    cursor.execute(stats.partition_trigger_sql(table, partition_id))
+    if view:
+        rebuild_views(cursor, (table,))
+    bump_data_version(cursor)  # the partition list changes
+    logging.info(f"Created partition {name} for {format_timestamp(start)} - {format_timestamp(end)}")
+    return partition_id, start, end
+
+
+# terms per compound SELECT in union_sql(); SQLite refuses more than 500 (SQLITE_MAX_COMPOUND_SELECT)
+COMPOUND_TERMS = 250
+
+
+def create_upcoming_partitions(cursor, now):
+    """
+    Create the partitions of both tables for the period holding `now` and the next one,
+    unless they exist. Call inside a write transaction. Returns how many were created.
+    """
+    created = 0
+    for ts in (now, period_bounds(now, PARTITION_PERIOD)[1]):
+        for table in FIELDS:
+            if not live_partitions(cursor, table, ts, ts):
+                create_partition(cursor, table, ts)
+                created += 1
+    return created
+
+
+def union_sql(table, names):
+    """
+    SELECT over the given partitions of `table`, or an empty one with the same columns.
+    More than COMPOUND_TERMS partitions are grouped into nested UNION ALLs.
+    """
+    columns = select_columns(table)
+    if not names:
+        return f"SELECT {', '.join(f'NULL AS {column}' for column in columns.split(', '))} WHERE 0"
+    terms = [f"SELECT {columns} FROM {name}" for name in names]
+    while len(terms) > COMPOUND_TERMS:
+        terms = [f"SELECT {columns} FROM ({' UNION ALL '.join(terms[i:i + COMPOUND_TERMS])})"
+                 for i in range(0, len(terms), COMPOUND_TERMS)]
+    return ' UNION ALL '.join(terms)
+
+
+def rebuild_views(cursor, tables=FIELDS):
+    """Point the incidents and malware_reports views (or those in `tables`) at the current live partitions."""
+    for table in tables:
+        names = [partition_name(table, partition_id) for _, partition_id, _, _ in live_partitions(cursor, table)]
+        cursor.execute(f"DROP VIEW IF EXISTS {table}")
+        cursor.execute(f"CREATE VIEW {table} AS {union_sql(table, names)}")
+
+
+def ordered_partitions(cursor, table, low=None, high=None, order='desc'):
+    """
+    Names of the live partitions of `table` that can hold a ts in [low, high], newest
+    first for order 'desc'. Partitions don't overlap in time, so reading them one after
+    the other in this order yields rows in (ts, id) order without merging them all.
+    """
+    partitions = live_partitions(cursor, table, low, high)
+    if order == 'desc':
+        partitions.reverse()
+    return [partition_name(table, partition_id) for _, partition_id, _, _ in partitions]
+
+
+def partition_source(cursor, table, low=None, high=None):
+    """
+    FROM clause for reading `table` where ts is known to lie in [low, high]: the view
+    when unbounded, otherwise a UNION ALL of only the partitions in that range.
+    """
+    if low is None and high is None:
+        return table
+    names = [partition_name(table, partition_id)
+             for _, partition_id, _, _ in live_partitions(cursor, table, low, high)]
+    return f"({union_sql(table, names)})"
+
+
+def reset_partitions(cursor):
+    """Swap in empty tables: retire every live partition. Constant time, run in a transaction."""
+    cursor.execute("UPDATE partitions SET state = 'discarded', retired_at = ? WHERE state = 'live'", (time.time(),))
+    rebuild_views(cursor)
+    bump_data_version(cursor)
+
+
+def expire_partitions(cursor, before, table=None):
+    """
+    Retire the live partitions that end at or before `before` (epoch seconds), for one
+    table or both. Only whole partitions go, and only their registry rows change (the
+    stats count live partitions only), so it takes the same time however many rows
+    they hold. Run in a transaction. Returns their (table, id, start_ts, end_ts).
+    """
+    expired = [partition for partition in live_partitions(cursor, table) if partition[3] <= before]
+    for _, partition_id, _, _ in expired:
+        cursor.execute("UPDATE partitions SET state = 'expired', retired_at = ? WHERE id = ? AND state = 'live'",
+                       (time.time(), partition_id))
+    if expired:
+        rebuild_views(cursor)
+        bump_data_version(cursor)
+    return expired
+
+
+def drop_retired_partitions(conn, grace=60.0):
+    """
+    Drop partitions retired more than `grace` seconds ago, with their summary rows;
+    readers that fetched the partition list just before the retirement may still be
+    scanning them until then. One transaction per partition, and unlike retiring this
+    takes time in proportion to its size. Returns the number of partitions dropped.
+    """
+    import stats  # stats imports storage
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, table_name, state FROM partitions WHERE state != 'live' AND retired_at <= ?",
+                   (time.time() - grace,))
+    dropped = 0
+    for partition_id, table, state in cursor.fetchall():
+        name = partition_name(table, partition_id)
+        with conn:
+            cursor.execute("DELETE FROM partitions WHERE id = ? AND state != 'live'", (partition_id,))
+            if cursor.rowcount != 1:
+                continue  # another process got there first
+            cursor.execute(f"DROP TABLE IF EXISTS {name}")
+            stats.drop_partition_stats(cursor, partition_id)
+            bump_data_version(cursor)  # the partition list changes
+        dropped += 1
+        logging.info(f"Dropped {state} partition {name}")
+    return dropped
+
+
+def reclaim_space(conn, step=1000, pause=0.01):
+    """Hand free pages back to the file system, `step` pages per transaction. Needs auto_vacuum = INCREMENTAL."""
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] != 2:
+        return
+    while True:
+        cursor.execute('PRAGMA freelist_count')
+        if not cursor.fetchone()[0]:
+            break
+        cursor.execute(f'PRAGMA incremental_vacuum({step})').fetchall()  # frees a page per step
+        time.sleep(pause)
+
+
+# ---- schema and migration -----------------------------------------------------
+
+def _table_columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cursor.fetchall()}
+
+
+def _is_table(cursor, name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def create_schema(cursor):
+    """
+    Create labels, the partition registry and the views. Tables of older databases
+    are renamed out of the way without touching a row: version 0 (text columns) to
+    *_legacy, versions 1 and 2 (one compact table each) to *_unpartitioned. Version 3
+    partitions (and *_unpartitioned tables) get the ts_text column.
+    Returns True if rows are waiting for run_migrations().
+    """
+    cursor.execute('PRAGMA user_version')
+    version = cursor.fetchone()[0]
+    if version < 3:
+        suffix = '_legacy' if version < 1 else '_unpartitioned'
+        for table in FIELDS:
+            if not _is_table(cursor, table):
+                continue
+            if version == 1 and table == 'incidents' and 'source_text' not in _table_columns(cursor, table):
+                cursor.execute('ALTER TABLE incidents ADD COLUMN source_text TEXT')
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_stats_{table}")
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {table}{suffix}")
+        for index in LEGACY_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {index}")
+        for table in ('stats_incidents_hourly', 'stats_incident_sources', 'stats_malware_types', 'stats_confidence'):
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")  # rebuilt by stats, migrated rows are counted as they move
+
+    cursor.execute(LABELS_TABLE)
+    cursor.execute(PARTITIONS_TABLE)
+    cursor.execute(PARTITIONS_INDEX)
+    if version < 4:
+        cursor.execute('SELECT table_name, id FROM partitions')
+        names = [partition_name(table, partition_id) for table, partition_id in cursor.fetchall()]
+        for name in names + [name for name in legacy_tables(cursor) if name.endswith('_unpartitioned')]:
+            if _is_table(cursor, name) and 'ts_text' not in _table_columns(cursor, name):
+                cursor.execute(f"ALTER TABLE {name} ADD COLUMN ts_text TEXT")
+    cursor.execute(DATA_VERSION_TABLE)
+    cursor.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)')
+    rebuild_views(cursor)
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return bool(legacy_tables(cursor))
+
+
+def run_migrations(conn):
+    """Background part of create_schema(): move the rows of older layouts into partitions."""
+    migrate_legacy(conn)
+
+
+def legacy_tables(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                   "AND (name LIKE '%\\_legacy' ESCAPE '\\' OR name LIKE '%\\_unpartitioned' ESCAPE '\\')")
+    return [name for (name,) in cursor.fetchall()]
+
+
+def migrate_legacy(conn, chunk_size=5000, pause=0.01):
+    """
+    Move rows from the *_legacy and *_unpartitioned tables into partitions, `chunk_size`
+    rows per transaction, sleeping `pause` seconds in between so ingest gets the write
+    lock. Every row goes through encode_fields() again, which also packs the IP
+    addresses version 1 stored as text. Rows that can't be converted are left behind
+    and logged; an old table is dropped once it's empty.
+    """
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA database_list')
+    path = cursor.fetchone()[2]  # label cache key
+    for old in legacy_tables(cursor):
+        table, _, kind = old.rpartition('_')
+        if kind == 'legacy':
+            fields = [field for field, _, _ in FIELDS[table] if field in _table_columns(cursor, old)]
+            columns = ', '.join(fields)
+        else:
+            columns = select_columns(table)
+        last_rowid, moved, skipped = 0, 0, 0
+        while True:
+            cursor.execute(f"SELECT rowid, {columns} FROM {old} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                           (last_rowid, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            if kind == 'legacy':
+                records = [dict(zip(fields, values)) for _, *values in rows]
+            else:
+                records = decode_rows(cursor, path, table, [values for _, *values in rows])
+            with conn:
+                done, labels, params = [], [], []
+                for (rowid, *_), record in zip(rows, records):
+                    try:
+                        _, row, row_labels = encode_fields(table, record)
+                    except ValueError as e:
+                        logging.warning(f"{old} row {rowid} not migrated: {e}")
+                        skipped += 1
+                        continue
+                    params.append((table, row))
+                    labels.extend(row_labels)
+                    done.append((rowid,))
+                ensure_labels(cursor, labels)
+                insert_rows(cursor, params)
+                cursor.executemany(f"DELETE FROM {old} WHERE rowid = ?", done)
+            moved += len(done)
+            last_rowid = rows[-1][0]
+            time.sleep(pause)
+        if not skipped:
+            with conn:
+                cursor.execute(f"DROP TABLE {old}")
+        logging.info(f"Migrated {moved} rows from {old} to {table}, {skipped} left behind")
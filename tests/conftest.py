@@ -0,0 +1,93 @@
+import os
+import sys
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as server  # noqa: E402
+import storage  # noqa: E402
+
+
+def incident(timestamp, source_value, confidence_level=0.5, report_subcategory='dos'):
+    return {
+        "report_category": "eu.acdc.attack",
+        "report_type": "incident",
+        "timestamp": timestamp,
+        "source_key": "ip",
+        "source_value": source_value,
+        "confidence_level": confidence_level,
+        "version": 2,
+        "report_subcategory": report_subcategory,
+        "ip_protocol_number": 6,
+        "ip_version": 6 if ':' in source_value else 4,
+    }
+
+
+def malware(timestamp, source_value, report_type='Dropper', confidence_level=0.5):
+    return {
+        "report_category": "eu.acdc.malware",
+        "report_type": report_type,
+        "timestamp": timestamp,
+        "source_key": "malware",
+        "source_value": source_value,
+        "confidence_level": confidence_level,
+        "version": 2,
+    }
+
+
+def stats_snapshot(client):
+    return {
+        'top_sources': {item['source_value']: item['count']
+                        for item in client.get('/api/stats/top-sources?limit=1000').json['items']},
+        'confidence': [item['count'] for item in client.get('/api/stats/confidence').json['items']],
+        'malware_types': {item['report_type']: item['count']
+                          for item in client.get('/api/stats/malware-types').json['items']},
+    }
+
+
+def canonical_ip(value):
+    """Top sources count per address, so they report its canonical spelling."""
+    return storage.decode_source('incidents', storage.encode_source('incidents', value))
+
+
+def expected_stats(records):
+    incidents = [record for record in records if record['report_category'] == 'eu.acdc.attack']
+    buckets = Counter(min(int(record['confidence_level'] * 10), 9) for record in incidents)
+    return {
+        'top_sources': dict(Counter(canonical_ip(record['source_value']) for record in incidents)),
+        'confidence': [buckets.get(bucket, 0) for bucket in range(10)],
+        'malware_types': dict(Counter(record['report_type'] for record in records
+                                      if record['report_category'] == 'eu.acdc.malware')),
+    }
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Path of an empty database the app points at; background threads are left out."""
+    path = str(tmp_path / 'test.db')
+    server.close_writer()
+    server.close_all_db()
+    monkeypatch.setitem(server.app.config, 'DATABASE', path)
+    monkeypatch.setattr(storage, 'PARTITION_PERIOD', storage.PARTITION_PERIOD)  # init_db() sets it
+    monkeypatch.setattr(server, 'start_partition_maintenance', lambda: None)
+
+    def migrate():  # to the end, inside init_db() instead of in a thread
+        conn = server.connect_db(path)
+        try:
+            storage.run_migrations(conn)
+        finally:
+            conn.close()
+
+    monkeypatch.setattr(server, 'start_migration', migrate)
+    yield path
+    server.close_writer()
+    server.close_all_db()
+
+
+@pytest.fixture
+def client(database):
+    with server.app.app_context():
+        server.init_db()
+    return server.app.test_client()
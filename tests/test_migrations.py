@@ -0,0 +1,131 @@
+import ipaddress
+import sqlite3
+
+import app as server
+import storage
+from conftest import expected_stats, incident, malware, stats_snapshot
+
+
+# the layouts as earlier versions of the app created them
+VERSION_0 = (
+    '''CREATE TABLE incidents (
+        report_category TEXT, report_type TEXT, timestamp TEXT, source_key TEXT, source_value TEXT,
+        confidence_level TEXT, version INTEGER, report_subcategory TEXT, ip_protocol_number TEXT, ip_version TEXT,
+        UNIQUE (report_category, report_type, timestamp, source_key, source_value, confidence_level))''',
+    '''CREATE TABLE malware_reports (
+        report_category TEXT, report_type TEXT, timestamp TEXT, source_key TEXT, source_value TEXT,
+        confidence_level REAL, version INTEGER,
+        UNIQUE (report_category, report_type, timestamp, source_key, source_value))''',
+)
+TEXT_NUMBERS = ('confidence_level', 'ip_protocol_number', 'ip_version')
+VERSION_2 = (
+    'CREATE TABLE labels (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)',
+    '''CREATE TABLE incidents (
+        id INTEGER PRIMARY KEY, ts INTEGER NOT NULL, category_id INTEGER, type_id INTEGER, source_key_id INTEGER,
+        source BLOB, source_text TEXT, confidence REAL, version INTEGER, subcategory_id INTEGER,
+        ip_protocol_number INTEGER, ip_version INTEGER,
+        UNIQUE (source, ts, type_id, confidence, category_id, source_key_id))''',
+    'CREATE INDEX idx_incidents_ts ON incidents (ts)',
+    '''CREATE TABLE malware_reports (
+        id INTEGER PRIMARY KEY, ts INTEGER NOT NULL, category_id INTEGER, type_id INTEGER, source_key_id INTEGER,
+        source BLOB, confidence REAL, version INTEGER,
+        UNIQUE (source, ts, type_id, category_id, source_key_id))''',
+    'CREATE INDEX idx_malware_ts ON malware_reports (ts)',
+)
+
+RECORDS = [
+    incident('2024-01-10T00:00:00Z', '1.1.1.1', 0.55),
+    incident('2024-02-11T00:00:00Z', '1.1.1.1', 0.25),
+    incident('2024-03-12T00:00:00Z', '2001:db8::1', 0.95),
+    malware('2024-01-12T00:00:00Z', 'aa' * 32),
+    malware('2024-03-13T00:00:00Z', 'bb' * 32, report_type='Sample from spam'),
+]
+
+
+def create_database(path, statements, version):
+    conn = sqlite3.connect(path)
+    for statement in statements:
+        conn.execute(statement)
+    conn.execute(f"PRAGMA user_version = {version}")
+    conn.commit()
+    return conn
+
+
+def migrated_items(client, path):
+    return [{key: value for key, value in item.items() if key != 'id'}
+            for item in client.get(path, query_string={'limit': 100, 'order': 'asc'}).json['items']]
+
+
+def check_migrated(database, records):
+    with server.app.app_context():
+        server.init_db()
+    client = server.app.test_client()
+
+    by_time = sorted(records, key=lambda record: storage.parse_timestamp(record['timestamp']))
+    assert migrated_items(client, '/api/incidents') == [
+        record for record in by_time if record['report_category'] == 'eu.acdc.attack']
+    assert migrated_items(client, '/api/malware') == [
+        record for record in by_time if record['report_category'] == 'eu.acdc.malware']
+    assert stats_snapshot(client) == expected_stats(records)
+
+    conn = sqlite3.connect(database)
+    try:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == storage.SCHEMA_VERSION == 4
+        assert storage.legacy_tables(conn.cursor()) == []
+        assert {table for (table,) in conn.execute('SELECT DISTINCT table_name FROM partitions')} == {
+            'incidents', 'malware_reports'}
+    finally:
+        conn.close()
+
+
+def test_migrate_from_version_0(database):
+    records = RECORDS + [
+        incident('2024-02-20T10:00:00+00:00', '3.3.3.3', 0.45),  # spellings version 0 kept as uploaded
+        incident('2024-02-21T10:00:00.500Z', '2001:DB8::2', 0.45),
+    ]
+    conn = create_database(database, VERSION_0, 0)
+    for record in records:
+        table = 'incidents' if record['report_category'] == 'eu.acdc.attack' else 'malware_reports'
+        fields = [field for field, _, _ in storage.FIELDS[table]]
+        # version 0 stored whatever the upload sent, numbers in TEXT columns as text
+        values = [str(record[field]) if table == 'incidents' and field in TEXT_NUMBERS else record[field]
+                  for field in fields]
+        conn.execute(f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})", values)
+    conn.commit()
+    conn.close()
+
+    check_migrated(database, records)
+
+
+def test_migrate_from_version_2(database):
+    records = RECORDS + [incident('2024-02-21T10:00:00Z', '2001:DB8::2', 0.45)]
+    conn = create_database(database, VERSION_2, 2)
+    labels = {}
+
+    def label(value):
+        if value not in labels:
+            labels[value] = conn.execute('INSERT INTO labels (value) VALUES (?)', (value,)).lastrowid
+        return labels[value]
+
+    for record in records:
+        ts = storage.parse_timestamp(record['timestamp'])
+        common = (ts, label(record['report_category']), label(record['report_type']),
+                  label(record['source_key']))
+        if record['report_category'] == 'eu.acdc.attack':
+            address = ipaddress.ip_address(record['source_value'])
+            text = None if str(address) == record['source_value'] else record['source_value']
+            conn.execute('INSERT INTO incidents (ts, category_id, type_id, source_key_id, source, source_text, '
+                         'confidence, version, subcategory_id, ip_protocol_number, ip_version) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         common + (address.packed, text, record['confidence_level'], record['version'],
+                                   label(record['report_subcategory']), record['ip_protocol_number'],
+                                   record['ip_version']))
+        else:
+            conn.execute('INSERT INTO malware_reports (ts, category_id, type_id, source_key_id, source, '
+                         'confidence, version) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         common + (bytes.fromhex(record['source_value']), record['confidence_level'],
+                                   record['version']))
+    conn.commit()
+    conn.close()
+
+    check_migrated(database, records)
@@ -0,0 +1,61 @@
+import gzip
+import json
+
+import pytest
+
+import app as server
+from conftest import incident, malware
+
+
+RECORDS = [
+    incident('2024-03-10T00:00:00Z', '1.1.1.1'),
+    incident('2024-03-11T00:00:00Z', '2.2.2.2'),
+    malware('2024-03-12T00:00:00Z', 'aa' * 32),
+    incident('2024-03-12T00:00:00Z', '3.3.3.3'),
+    malware('2024-03-13T00:00:00Z', 'bb' * 32),
+]
+
+
+def ndjson(records, extra_lines=()):
+    return ''.join([json.dumps(record) + '\n' for record in records] + list(extra_lines)).encode()
+
+
+@pytest.mark.parametrize('compress', [False, True], ids=['plain', 'gzip'])
+def test_ndjson_upload_summary(client, monkeypatch, compress):
+    monkeypatch.setitem(server.app.config, 'NDJSON_CHUNK_SIZE', 2)
+    body = ndjson(RECORDS + [RECORDS[0]], ['\n', '{not json\n', json.dumps({"report_category": "x"}) + '\n'])
+    headers = {'Content-Encoding': 'gzip'} if compress else {}
+
+    response = client.post('/upload-ndjson', data=gzip.compress(body) if compress else body,
+                           content_type='application/x-ndjson', headers=headers)
+
+    assert response.status_code == 200, response.json
+    summary = response.json
+    assert summary['tables'] == {
+        'incidents': {'inserted': 3, 'duplicate': 1},
+        'malware_reports': {'inserted': 2, 'duplicate': 0},
+    }
+    assert summary['lines'] == 8
+    assert summary['chunks'] == 4
+    assert summary['invalid'] == 2
+    assert [error['line'] for error in summary['errors']] == [8, 9]
+    assert len(client.get('/api/incidents').json['items']) == 3
+    assert len(client.get('/api/malware').json['items']) == 2
+
+
+def test_ndjson_upload_of_many_lines(client):
+    records = [incident(f'2024-03-{day:02}T{hour:02}:{minute:02}:00Z', f'10.0.{hour}.{minute}')
+               for day in range(1, 3) for hour in range(24) for minute in range(60)]
+    response = client.post('/upload-ndjson', data=ndjson(records), content_type='application/x-ndjson')
+    assert response.status_code == 200, response.json
+    assert response.json['tables']['incidents'] == {'inserted': len(records), 'duplicate': 0}
+    assert response.json['lines'] == len(records)
+
+
+def test_ndjson_rejects_other_encodings(client):
+    response = client.post('/upload-ndjson', data=ndjson(RECORDS), content_type='application/x-ndjson',
+                           headers={'Content-Encoding': 'br'})
+    assert response.status_code == 415
+    response = client.post('/upload-ndjson', data=b'\x1f\x8b broken', content_type='application/x-ndjson',
+                           headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 400
@@ -0,0 +1,192 @@
+import json
+
+import pytest
+
+import app as server
+import storage
+from conftest import expected_stats, incident, malware, stats_snapshot
+
+
+JANUARY = [
+    incident('2024-01-10T00:00:00Z', '1.1.1.1', 0.55),
+    incident('2024-01-11T00:00:00Z', '2.2.2.2', 0.55),
+    malware('2024-01-12T00:00:00Z', 'aa' * 32),
+]
+MARCH = [
+    incident('2024-03-10T00:00:00Z', '1.1.1.1', 0.55),
+    incident('2024-03-11T00:00:00Z', '1.1.1.1', 0.52),
+    incident('2024-03-12T00:00:00Z', '3.3.3.3', 0.51),
+    malware('2024-03-13T00:00:00Z', 'bb' * 32, report_type='Sample from spam'),
+]
+
+
+def upload(client, records):
+    response = client.post('/upload-json-files', json=records)
+    assert response.status_code == 200, response.json
+    assert response.json['summary']['inserted'] == len(records)
+
+
+def drop_retired():
+    with server.app.app_context():
+        return storage.drop_retired_partitions(server.get_db(), grace=0)
+
+
+def all_items(client, path, **query):
+    items, cursor = [], None
+    while True:
+        page = client.get(path, query_string={**query, **({'cursor': cursor} if cursor else {})}).json
+        items.extend(page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return items
+
+
+def test_expire_takes_partitions_out_of_reads_and_stats(client):
+    upload(client, JANUARY + MARCH)
+
+    response = client.post('/api/partitions/expire?before=2024-02-01T00:00:00Z')
+    assert response.status_code == 200
+    assert sorted(item['table'] for item in response.json['items']) == ['incidents', 'malware_reports']
+
+    assert [item['timestamp'] for item in all_items(client, '/api/incidents')] == [
+        '2024-03-12T00:00:00Z', '2024-03-11T00:00:00Z', '2024-03-10T00:00:00Z']
+    assert stats_snapshot(client) == expected_stats(MARCH)
+
+
+def test_rebuild_during_drop_grace_does_not_subtract_twice(client):
+    upload(client, JANUARY + MARCH)
+    client.post('/api/partitions/expire?before=2024-02-01T00:00:00Z')
+
+    assert client.post('/api/stats/rebuild').status_code == 200
+    assert stats_snapshot(client) == expected_stats(MARCH)
+
+    assert drop_retired() == 2
+    assert stats_snapshot(client) == expected_stats(MARCH)
+    assert {item['state'] for item in client.get('/api/partitions').json['items']} == {'live'}
+
+
+def test_reset_during_drop_grace(client):
+    upload(client, JANUARY + MARCH)
+    client.post('/api/partitions/expire?before=2024-02-01T00:00:00Z')
+
+    assert client.post('/reset-database').status_code == 200
+    assert drop_retired() == 4
+    assert stats_snapshot(client) == expected_stats([])
+    assert client.get('/api/incidents').json['items'] == []
+
+    upload(client, MARCH)  # new partitions after the reset
+    assert stats_snapshot(client) == expected_stats(MARCH)
+
+
+def test_expire_keeps_partitions_ending_after_the_cutoff(client):
+    upload(client, JANUARY + MARCH)
+    response = client.post('/api/partitions/expire?before=2024-01-31T00:00:00Z&table=incidents')
+    assert response.status_code == 200
+    assert response.json['items'] == []
+    assert client.post('/api/partitions/expire').status_code == 400
+    assert client.post('/api/partitions/expire?before=2024-02-01&table=nope').status_code == 400
+
+
+def test_more_partitions_than_a_compound_select_takes(database, monkeypatch):
+    days = 510  # SQLite refuses a compound SELECT with more than 500 terms
+    monkeypatch.setitem(server.app.config, 'PARTITION_PERIOD', 'day')
+    with server.app.app_context():
+        server.init_db()
+    client = server.app.test_client()
+    records = [incident(storage.format_timestamp(1672531200 + day * 86400), f"10.0.{day >> 8}.{day & 255}",
+                        confidence_level=round(day % 10 / 10, 1))
+               for day in range(days)]
+    for start in range(0, days, 100):
+        upload(client, records[start:start + 100])
+
+    assert len(client.get('/api/partitions').json['items']) == days
+
+    timestamps = [item['timestamp'] for item in all_items(client, '/api/incidents', limit=100)]
+    assert timestamps == sorted((record['timestamp'] for record in records), reverse=True)
+
+    oldest_first = [item['timestamp'] for item in all_items(client, '/api/incidents', limit=100, order='asc')]
+    assert oldest_first == sorted(record['timestamp'] for record in records)
+
+    export = client.get('/export/incidents').data.decode().splitlines()
+    assert [json.loads(line)['timestamp'] for line in export] == oldest_first
+
+    found = all_items(client, '/api/incidents/ip-search', cidr='10.0.0.0/16', limit=1000)
+    assert len(found) == days
+
+    assert client.post('/api/stats/rebuild').status_code == 200
+    assert stats_snapshot(client) == expected_stats(records)
+
+
+@pytest.mark.parametrize('timestamp', [
+    '2024-05-01T12:30:00.123456789Z',
+    '2024-05-01T12:30:00.000Z',
+    '2024-05-01T14:30:00+02:00',
+    '2024-05-01t12:30:00z',
+])
+def test_timestamps_come_back_as_uploaded(client, timestamp):
+    upload(client, [incident(timestamp, '2001:DB8::1')])
+    [item] = client.get('/api/incidents').json['items']
+    assert item['timestamp'] == timestamp
+    assert item['source_value'] == '2001:DB8::1'
+
+
+def test_same_instant_and_address_in_another_spelling_is_a_duplicate(client):
+    upload(client, [incident('2024-05-01T14:30:00+02:00', '2001:DB8::1')])
+    response = client.post('/upload-json-files', json=incident('2024-05-01T12:30:00.000Z', '2001:db8::1'))
+    assert response.json['summary'] == {'inserted': 0, 'duplicate': 1, 'invalid': 0}
+
+
+def test_expire_does_not_read_the_partitions(client, database):
+    upload(client, JANUARY + MARCH)
+    conn = server.connect_db(database)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    with conn:
+        expired = storage.expire_partitions(conn.cursor(), storage.parse_timestamp('2024-02-01T00:00:00Z'))
+    conn.set_trace_callback(None)
+    names = [storage.partition_name(table, partition_id) for table, partition_id, _, _ in expired]
+    assert len(names) == 2
+    assert not [statement for statement in statements if any(name in statement for name in names)]
+
+    # their summary rows stay until the tables are dropped, but no longer count
+    assert stats_snapshot(client) == expected_stats(MARCH)
+    expired_ids = [partition_id for _, partition_id, _, _ in expired]
+    count = f"SELECT count(*) FROM stats_confidence WHERE partition_id IN ({', '.join('?' * len(expired_ids))})"
+    assert conn.execute(count, expired_ids).fetchone()[0] > 0
+    assert drop_retired() == 2
+    assert conn.execute(count, expired_ids).fetchone()[0] == 0
+    conn.close()
+
+
+def test_stats_without_partition_ids_are_rebuilt(client, database):
+    upload(client, JANUARY)
+    conn = server.connect_db(database)
+    with conn:  # the layout before summary rows were kept per partition
+        for table, keys in (('stats_incidents_hourly', 'hour INTEGER, subcategory_id INTEGER'),
+                            ('stats_incident_sources', 'source BLOB'), ('stats_malware_types', 'type_id INTEGER'),
+                            ('stats_confidence', 'table_name TEXT, bucket INTEGER')):
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"CREATE TABLE {table} ({keys}, count INTEGER NOT NULL)")
+        for table, partition_id, _, _ in storage.live_partitions(conn.cursor()):
+            name = storage.partition_name(table, partition_id)
+            conn.execute(f"DROP TRIGGER trg_stats_{name}")
+            conn.execute(f"CREATE TRIGGER trg_stats_{name} AFTER INSERT ON {name} BEGIN "
+                         "INSERT INTO stats_confidence (table_name, bucket, count) VALUES ('x', 0, 1); END")
+    conn.close()
+    server.close_all_db()
+
+    with server.app.app_context():
+        server.init_db()
+    assert stats_snapshot(client) == expected_stats(JANUARY)
+    added = [MARCH[0], incident('2024-01-20T00:00:00Z', '4.4.4.4')]  # a new and an existing partition
+    upload(client, added)
+    assert stats_snapshot(client) == expected_stats(JANUARY + added)
+
+
+def test_partitions_created_ahead_show_up_in_the_cached_listing(client, database):
+    assert client.get('/api/partitions').json['items'] == []
+    conn = server.connect_db(database)
+    with conn:
+        assert storage.create_upcoming_partitions(conn.cursor(), storage.parse_timestamp('2024-05-10T00:00:00Z')) == 4
+    conn.close()
+    assert len(client.get('/api/partitions').json['items']) == 4
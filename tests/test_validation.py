@@ -0,0 +1,29 @@
+import pytest
+
+from client.validation import validate_report
+from conftest import incident
+
+
+@pytest.mark.parametrize('timestamp, valid', [
+    ('2016-12-31T23:59:59Z', True),
+    ('2016-12-31T23:59:59.5+23:59', True),
+    ('2016-12-31T23:59:59+25:99', False),
+    ('2016-12-31T23:59:59-24:00', False),
+    ('2016-12-31T23:59:59+05:60', False),
+    ('2016-02-30T00:00:00Z', False),
+    ('2016-12-31T23:59:60Z', True),
+    ('2016-12-31T15:59:60-08:00', True),
+    ('2016-12-31T12:59:60Z', False),
+    ('2016-12-31T23:59:61Z', False),
+])
+def test_date_time(timestamp, valid):
+    assert validate_report(incident(timestamp, '1.1.1.1'))[0] is valid
+    # a record off the fast path still gets the same answer from the full validator
+    assert validate_report({**incident(timestamp, '1.1.1.1'), 'version': 2.0})[0] is valid
+
+
+def test_leap_second_is_stored_as_the_next_second(client):
+    response = client.post('/upload-json-files', json=[incident('2016-12-31T23:59:60Z', '1.1.1.1')])
+    assert response.json['summary']['inserted'] == 1
+    [item] = client.get('/api/incidents?since=2017-01-01T00:00:00Z&until=2017-01-01T00:00:01Z').json['items']
+    assert item['timestamp'] == '2016-12-31T23:59:60Z'
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+
+import pytest
+
+import app as server
+import writer
+from conftest import incident, malware
+
+
+@pytest.fixture
+def queued(client, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'INGEST_MODE', 'queue')
+    monkeypatch.setitem(server.app.config, 'INGEST_COMMIT_TIMEOUT_S', 5)
+    return client
+
+
+def post_concurrently(batches):
+    barrier = threading.Barrier(len(batches))
+    responses = [None] * len(batches)
+
+    def post(i):
+        client = server.app.test_client()
+        barrier.wait()
+        responses[i] = client.post('/upload-json-files', json=batches[i])
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(len(batches))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return responses
+
+
+def test_concurrent_uploads_share_a_commit(queued, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'INGEST_GROUP_WINDOW_MS', 1000)  # room for every upload to arrive
+    shared = incident('2024-04-01T00:00:00Z', '9.9.9.9')
+    batches = [[incident(f'2024-04-01T00:00:{i:02}Z', f'10.0.0.{i}'), shared, {"report_category": "x"}]
+               for i in range(1, 9)]
+
+    responses = post_concurrently(batches)
+
+    statuses = [[result['status'] for result in response.json['results']] for response in responses]
+    assert all(status[0] == 'inserted' and status[2] == 'invalid' for status in statuses)
+    assert sorted(status[1] for status in statuses) == ['duplicate'] * 7 + ['inserted']
+    assert server.get_writer().groups == 1
+    assert server.get_writer().rows == 16
+    assert len(queued.get('/api/incidents').json['items']) == 9
+
+
+def test_accepted_uploads_land_after_flush(queued, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'INGEST_ACK', 'accepted')
+    records = [incident('2024-04-01T00:00:00Z', '1.1.1.1'), malware('2024-04-01T00:00:00Z', 'aa' * 32)]
+
+    response = queued.post('/upload-json-files', json=records + [{"report_category": "x"}])
+
+    assert response.status_code == 202
+    assert [result['status'] for result in response.json['results']] == ['accepted', 'accepted', 'invalid']
+    server.get_writer().flush(5)
+    assert len(queued.get('/api/incidents').json['items']) == 1
+    assert len(queued.get('/api/malware').json['items']) == 1
+
+
+def test_commit_timeout_returns_503(queued, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'INGEST_COMMIT_TIMEOUT_S', 0.1)
+    gate = threading.Event()
+    connect = server.connect_db
+    monkeypatch.setattr(server, 'connect_db', lambda path: gate.wait(5) and connect(path))
+
+    response = queued.post('/upload-json-files', json=[incident('2024-04-01T00:00:00Z', '1.1.1.1')])
+    assert response.status_code == 503
+
+    gate.set()  # the rows still land once the writer gets through
+    server.get_writer().flush(5)
+    assert len(queued.get('/api/incidents').json['items']) == 1
+
+
+def test_unopenable_database_fails_uploads(database, tmp_path, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'DATABASE', str(tmp_path / 'missing' / 'test.db'))
+    monkeypatch.setitem(server.app.config, 'INGEST_MODE', 'queue')
+    monkeypatch.setitem(server.app.config, 'INGEST_COMMIT_TIMEOUT_S', 5)  # a hang would be a 503
+
+    for response in post_concurrently([[incident('2024-04-01T00:00:00Z', f'10.0.0.{i}')] for i in range(4)]):
+        assert response.status_code == 500
+        assert 'unable to open database' in response.json['message']
+
+
+def test_failed_connect_fails_every_queued_future():
+    def connect():
+        raise sqlite3.OperationalError('unable to open database file')
+
+    group_writer = writer.GroupCommitWriter(connect)
+    futures = []
+
+    def submit():
+        for _ in range(200):
+            futures.append(group_writer.submit([]))
+
+    threads = [threading.Thread(target=submit) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len(futures) == 800
+    for future in futures:
+        assert isinstance(future.exception(timeout=5), sqlite3.OperationalError)
+    group_writer.close(5)
@@ -0,0 +1,140 @@
+"""
+Single writer for write-behind ingest.
+
+Request threads validate and encode their records, then hand the rows to one
+writer thread instead of taking SQLite's write lock themselves. The writer
+collects everything that arrives within a short window (or up to max_rows rows)
+and writes it in one transaction, so N concurrent uploads cost one commit and
+one fsync instead of N, and nobody waits on "database is locked".
+
+Every submission gets a concurrent.futures.Future that resolves to one bool per
+row (True = inserted, False = duplicate) once the transaction has committed,
+or to the sqlite3.Error that rolled it back.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+import storage
+
+
+GROUP_ROWS = metrics.Histogram('ingest_group_commit_rows', 'Rows written per group commit',
+                               buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000))
+
+
+class _Submission:
+    __slots__ = ('rows', 'labels', 'future')
+
+    def __init__(self, rows, labels):
+        self.rows = rows
+        self.labels = labels
+        self.future = Future()
+
+
+class GroupCommitWriter:
+    """
+    One thread, one connection, one transaction per group of submissions.
+
+    `connect` opens the writer's private connection (called on the writer thread).
+    `max_queue` bounds the number of waiting submissions; submit() blocks when it
+    is full, which pushes back on clients instead of buffering without limit.
+    """
+
+    def __init__(self, connect, max_rows=5000, window=0.005, max_queue=1000):
+        self.connect = connect
+        self.max_rows = max_rows
+        self.window = window
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.groups = 0
+        self.rows = 0
+
+    def submit(self, rows, labels=()):
+        """Queue (table, row) pairs from storage.build_row(). Returns a Future of the per-row outcome."""
+        submission = _Submission(rows, labels)
+        self.queue.put(submission)
+        self.start()  # after the put: a writer that failed to connect drains it or has been given up on
+        return submission.future
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted before this call is committed."""
+        if self.thread is not None:
+            self.submit([]).result(timeout)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                self.thread.start()
+
+    def close(self, timeout=None):
+        """Commit what is still queued, then stop the thread."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join(timeout)
+
+    def _run(self):
+        try:
+            conn = self.connect()
+        except Exception as e:  # nobody would resolve the queued futures otherwise
+            logging.error(f"Ingest writer: opening the database failed: {e}")
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.thread = None  # the next submit() starts another attempt
+            self._fail_pending(e)
+            return
+        try:
+            stop = False
+            while not stop:
+                first = self.queue.get()
+                if first is None:
+                    break
+                group, rows = [first], len(first.rows)
+                deadline = time.monotonic() + self.window
+                while rows < self.max_rows:
+                    try:
+                        submission = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if submission is None:
+                        stop = True
+                        break
+                    group.append(submission)
+                    rows += len(submission.rows)
+                self._commit(conn, group)
+        finally:
+            conn.close()
+
+    def _fail_pending(self, error):
+        while True:
+            try:
+                submission = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if submission is not None:
+                submission.future.set_exception(error)
+
+    def _commit(self, conn, group):
+        try:
+            with metrics.SQL_SECONDS.time('group_commit'), conn:
+                cursor = conn.cursor()
+                storage.ensure_labels(cursor, set().union(*(submission.labels for submission in group)))
+                outcomes = [storage.insert_rows(cursor, submission.rows) for submission in group]
+        except Exception as e:  # resolve every future, the thread has to keep going
+            logging.error(f"Ingest writer: group of {len(group)} submissions rolled back: {e}")
+            for submission in group:
+                submission.future.set_exception(e)
+            return
+        rows = sum(len(submission.rows) for submission in group)
+        self.groups += 1
+        self.rows += rows
+        GROUP_ROWS.observe(rows)
+        for submission, inserted in zip(group, outcomes):
+            submission.future.set_result(inserted)